@@ -314,7 +314,9 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
         'How many records are buffered for random shuffling. This param '
         'affects how much RAM a train/test job needs. E.g., if an average '
         'record is about 500KB, the buffer needs 5GB ram.')
-    p.Define('file_parallelism', 16, 'How many files to read concurrently.')
+    p.Define(
+        'file_parallelism', 16, 'How many files to read concurrently. A '
+        'negative value uses the number of CPUs available on the host.')
     p.Define(
         'bucket_adjust_every_n', 0, 'If non-zero, optimize the values of '
         'bucket_upper_bound except the last one after every N records '
@@ -324,6 +326,11 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
         'so far every these many records are yielded.')
     p.Define('num_batcher_threads', 1, 'Number of threads to use for input '
              'record batcher.')
+    p.Define(
+        'prefetch_buffer_size', 1,
+        'Number of merged batches the input op buffers ahead of the '
+        'consumer. Values larger than 1 let batch assembly overlap with the '
+        'training step, at the cost of holding more batches in memory.')
     p.Define(
         'require_sequential_order', False,
         'If true, the input op is required to process the file glob as '
@@ -440,6 +447,7 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
         'bucket_adjust_every_n': p.bucket_adjust_every_n,
         'flush_every_n': p.flush_every_n,
         'num_threads': p.num_batcher_threads,
+        'prefetch_buffer_size': p.prefetch_buffer_size,
         'require_sequential_order': p.require_sequential_order,
         'repeat_count': p.repeat_count,
         'use_chaining': p.use_chaining,
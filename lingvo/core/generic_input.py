@@ -59,6 +59,11 @@ def GenericInput(processor, **kwargs):
 
     input_batch, bucket_keys = GenericInput(ParseRecord, file_pattern=..., ...)
 
+  Records are read concurrently from up to `file_parallelism` files and handed
+  to the processor threads in whatever order they arrive, so a slow file never
+  holds back records from the others. Pass `require_sequential_order=True` when
+  a deterministic order is required instead.
+
   Args:
     processor: a function that takes either a tf.string record or a
       (source_id: tf.int32, record: tf.string) pair as input and returns a
@@ -21,7 +21,6 @@ from __future__ import print_function
 
 import collections
 import os
-import pickle
 from absl.testing import parameterized
 from lingvo import compat as tf
 from lingvo.core import generic_input
@@ -33,19 +32,28 @@ from six.moves import range
 
 class GenericInputOpTest(test_utils.TestCase, parameterized.TestCase):
 
-  def get_test_input(self, path, **kwargs):
+  def get_test_input(self, path, file_parallelism=4, **kwargs):
     return generic_input.GenericInput(
         file_pattern='tfrecord:' + path,
         file_random_seed=0,
         file_buffer_size=32,
-        file_parallelism=4,
+        file_parallelism=file_parallelism,
         bucket_batch_limit=[8],
         **kwargs)
 
-  @parameterized.named_parameters(('OutputList', False),
-                                  ('OutputNestedMap', True))
-  def testBasic(self, use_nested_map):
-    input_batch = self._RunBasicGraph(use_nested_map=use_nested_map)
+  def _WriteRecords(self, path, records):
+    """Writes a list of serialized 'records' to a TFRecord file at 'path'."""
+    with self.session(graph=tf.Graph()) as sess:
+      dataset = tf.data.Dataset.from_tensor_slices(records)
+      sess.run(tf.data.experimental.TFRecordWriter(path).write(dataset))
+
+  @parameterized.named_parameters(('OutputList', False, 1),
+                                  ('OutputNestedMap', True, 1),
+                                  ('PrefetchBuffer', True, 4))
+  def testBasic(self, use_nested_map, prefetch_buffer_size):
+    input_batch = self._RunBasicGraph(
+        use_nested_map=use_nested_map,
+        prefetch_buffer_size=prefetch_buffer_size)
     with self.session() as sess:
       record_seen = set()
       for i in range(100):
@@ -60,21 +68,27 @@ class GenericInputOpTest(test_utils.TestCase, parameterized.TestCase):
       for i in range(100):
         self.assertIn(('%08d' % i).encode('utf-8'), record_seen)
 
-  def _RunBasicGraph(self, use_nested_map, bucket_fn=lambda x: 1):
-    # Generate a test file w/ 100 records.
-    tmp = os.path.join(tf.test.get_temp_dir(), 'basic')
-    with tf.python_io.TFRecordWriter(tmp) as w:
+  def testNegativeFileParallelism(self):
+    # A negative file_parallelism uses the number of CPUs on the host.
+    input_batch = self._RunBasicGraph(use_nested_map=True, file_parallelism=-1)
+    with self.session() as sess:
+      record_seen = set()
+      for i in range(100):
+        ans_input_batch = sess.run(input_batch)
+        for s in ans_input_batch.record:
+          record_seen.add(s)
+        self.assertEqual(ans_input_batch.record.shape, (8,))
       for i in range(100):
-        w.write(('%08d' % i).encode('utf-8'))
+        self.assertIn(('%08d' % i).encode('utf-8'), record_seen)
 
-    # A simple string parsing routine. Just convert a string to a
-    # number.
-    def str_to_num(s):
-      return np.array(float(s), dtype=np.float32)
+  def _RunBasicGraph(self, use_nested_map, bucket_fn=lambda x: 1, **kwargs):
+    # Generate a test file w/ 100 records.
+    tmp = os.path.join(tf.test.get_temp_dir(), 'basic')
+    self._WriteRecords(tmp, [('%08d' % i).encode('utf-8') for i in range(100)])
 
     # A record processor written in TF graph.
     def _process(source_id, record):
-      num, = tf.py_func(str_to_num, [record], [tf.float32])
+      num = tf.strings.to_number(record, tf.float32)
       num = tf.stack([num, tf.square(num)])
       if use_nested_map:
         return py_utils.NestedMap(
@@ -85,7 +99,7 @@ class GenericInputOpTest(test_utils.TestCase, parameterized.TestCase):
     # Samples random records from the data files and processes them
     # to generate batches.
     inputs, _ = self.get_test_input(
-        tmp, bucket_upper_bound=[1], processor=_process)
+        tmp, bucket_upper_bound=[1], processor=_process, **kwargs)
     if use_nested_map:
       return inputs
     else:
@@ -95,15 +109,32 @@ class GenericInputOpTest(test_utils.TestCase, parameterized.TestCase):
   def testPadding(self):
     # Generate a test file w/ 50 records of different lengths.
     tmp = os.path.join(tf.test.get_temp_dir(), 'basic')
-    with tf.python_io.TFRecordWriter(tmp) as w:
-      for n in range(1, 50):
-        w.write(pickle.dumps(np.full([n, 3, 3], n, np.int32)))
+    self._WriteRecords(tmp, [
+        tf.train.Example(
+            features=tf.train.Features(
+                feature={
+                    'n':
+                        tf.train.Feature(
+                            int64_list=tf.train.Int64List(value=[n])),
+                    'data':
+                        tf.train.Feature(
+                            int64_list=tf.train.Int64List(
+                                value=[n] * (n * 3 * 3))),
+                })).SerializeToString() for n in range(1, 50)
+    ])
 
     g = tf.Graph()
     with g.as_default():
       # A record processor written in TF graph.
       def _process(record):
-        num = tf.py_func(pickle.loads, [record], tf.int32)
+        features = tf.parse_single_example(
+            record, {
+                'n': tf.FixedLenFeature([], tf.int64),
+                'data': tf.VarLenFeature(tf.int64),
+            })
+        n = tf.to_int32(features['n'])
+        num = tf.reshape(
+            tf.to_int32(tf.sparse.to_dense(features['data'])), [n, 3, 3])
         bucket_key = tf.shape(num)[0]
         return [num, tf.transpose(num, [1, 0, 2])], bucket_key
 
@@ -158,9 +189,8 @@ class GenericInputOpTest(test_utils.TestCase, parameterized.TestCase):
     # Generate couple files.
     def generate_test_data(tag, cnt):
       tmp = os.path.join(tf.test.get_temp_dir(), tag)
-      with tf.python_io.TFRecordWriter(tmp) as w:
-        for i in range(cnt):
-          w.write(('%s:%08d' % (tag, i)).encode('utf-8'))
+      self._WriteRecords(
+          tmp, [('%s:%08d' % (tag, i)).encode('utf-8') for i in range(cnt)])
       return tmp
 
     path1 = generate_test_data('input1', 100)
@@ -18,6 +18,7 @@ limitations under the License.
 #include "lingvo/core/ops/sequential_record_yielder.h"
 #include "lingvo/core/ops/chain_record_yielder.h"
 #include "lingvo/core/ops/weighted_mix_record_yielder.h"
+#include "tensorflow/core/platform/cpu_info.h"
 
 namespace tensorflow {
 namespace lingvo {
@@ -49,6 +50,11 @@ RecordYielder* ConstructYielder(const string& file_pattern,
     CHECK_EQ(repeat_count, -1) << "Repeat count must not be set unless "
                                   "require_sequential_order is true.";
   }
+  if (file_parallelism < 0) {
+    // Read as many files concurrently as there are cores on the host.
+    file_parallelism = port::NumSchedulableCPUs();
+    LOG(INFO) << "Auto-tuned file_parallelism to " << file_parallelism;
+  }
   std::vector<BasicRecordYielder::Options> yielder_options;
 
   for (int i = 0; i < file_patterns.size(); ++i) {
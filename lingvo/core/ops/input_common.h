@@ -61,11 +61,14 @@ class InputOp : public OpKernel {
     GETATTR(bool, require_sequential_order);
     GETATTR(int64, repeat_count);
     GETATTR(bool, use_chaining);
+    GETATTR(int64, prefetch_buffer_size);
 #undef GETATTR
     OP_REQUIRES(
         ctx,
         std::is_sorted(bucket_upper_bound.begin(), bucket_upper_bound.end()),
         errors::InvalidArgument("Bucket_upper_bound is not sorted"));
+    OP_REQUIRES(ctx, prefetch_buffer_size > 0,
+                errors::InvalidArgument("prefetch_buffer_size must be > 0"));
     if (require_sequential_order) {
       num_threads = 1;
     }
@@ -82,6 +85,7 @@ class InputOp : public OpKernel {
     bopts.bucket_adjust_every_n = bucket_adjust_every_n;
     bopts.flush_every_n = flush_every_n;
     bopts.num_threads = num_threads;
+    bopts.prefetch_buffer_size = prefetch_buffer_size;
     batcher_ = new RecordBatcher(bopts, yielder, processor_);
   }
 
@@ -34,8 +34,8 @@ limitations under the License.
 //
 // * The only merger thread pulls off TensorVecs from to_flush_ and
 //   calls processor->Merge() to merge samples into a single batch. It
-//   then hands the merged batch into curr_. If there is already one
-//   unconsumed batch, the merger thread blocks.
+//   then hands the merged batch into curr_. If there are already
+//   prefetch_buffer_size unconsumed batches, the merger thread blocks.
 //
 //   NOTE: merger_thread_ itself is single-threaded. We expect that if
 //   processor->Merge() becomes bottleneck (memory copy bounded), we
@@ -49,14 +49,15 @@ limitations under the License.
 //  + to_flush_                  // The batch to be merged.
 //  + to_flush                   // The batch being merged.
 //  + merged                     // The batch being merged.
-//  + curr_                      // The batch to be consumed.
+//  + curr_                      // The batches to be consumed.
 //
 //  If we assume each sample is roughly M bytes (in its string format
-//  or tensor format), each output batch has the batch size B, we can
+//  or tensor format), each output batch has the batch size B and P
+//  batches are prefetched (RecordBatcher.prefetch_buffer_size), we can
 //  estimate the peak memory usage of one RecordYielder+RecordBatcher
 //  is roughly
 //
-//    M * (file_buffer_size + sum(bucket_batch_limit) * 2 + B * 2)
+//    M * (file_buffer_size + sum(bucket_batch_limit) * 2 + B * (P + 1))
 
 #include "lingvo/core/ops/record_batcher.h"
 
@@ -83,12 +84,13 @@ RecordBatcher::RecordBatcher(const Options& opts, RecordYielder* yielder,
       merger_thread_(new thread::ThreadPool(Env::Default(), ThreadOptions(),
                                             "record_batcher_merger", 1,
                                             /* low_latency_hint */ false)),
-      curr_empty_(this, &ME::CurrEmpty),
+      curr_has_room_(this, &ME::CurrHasRoom),
       curr_non_empty_(this, &ME::CurrNonEmpty),
       to_flush_empty_(this, &ME::ToFlushEmpty),
       to_flush_non_empty_(this, &ME::ToFlushNonEmpty),
       bucket_upper_bound_(opts_.bucket_upper_bound) {
   CHECK_EQ(opts_.bucket_upper_bound.size(), opts_.bucket_batch_limit.size());
+  CHECK_GT(opts_.prefetch_buffer_size, 0);
   buckets_.resize(opts_.bucket_upper_bound.size());
   length_histogram_.resize(opts_.bucket_upper_bound.back() + 1, 0);
   start_time_ = std::time(nullptr);
@@ -136,11 +138,9 @@ Status RecordBatcher::GetNext(int64* bucket, TensorVec* batch) {
     return stop_status_;
   }
 
-  *bucket = curr_bucket_;
-  curr_bucket_ = -1;
-  using std::swap;
-  swap(*(batch), curr_);
-  curr_.clear();
+  *bucket = curr_.front().first;
+  *batch = std::move(curr_.front().second);
+  curr_.pop_front();
   return Status::OK();
 }
 
@@ -450,15 +450,14 @@ void RecordBatcher::MergerLoop() {
       } else {
         merged.push_back(bucket_keys);
         MutexLock l(&mu_);
-        WaitForCurrEmpty();
+        WaitForCurrHasRoom();
 
         // If stopped due to destructor, just exit, since there should be no
         // further calls to GetNext().
         if (stop_ && stop_status_.ok()) {
           return;
         }
-        curr_bucket_ = id;
-        curr_ = std::move(merged);
+        curr_.emplace_back(id, std::move(merged));
       }
     }
     to_flush.clear();
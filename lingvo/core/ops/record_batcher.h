@@ -17,6 +17,8 @@ limitations under the License.
 #define LINGVO_CORE_OPS_RECORD_BATCHER_H_
 
 #include <cstddef>
+#include <deque>
+#include <utility>
 #include <vector>
 
 #include "lingvo/core/ops/mutex.h"
@@ -90,6 +92,10 @@ class RecordBatcher {
     // Number of threads to use for record batcher, each thread
     // fills separate batches based on bucket limits.
     int64 num_threads = 1;
+
+    // Number of merged batches buffered ahead of GetNext(). The merger thread
+    // blocks once this many batches are waiting to be consumed.
+    int64 prefetch_buffer_size = 1;
   };
   RecordBatcher(const Options& opts, RecordYielder* yielder,
                 RecordProcessor* processor);
@@ -118,8 +124,9 @@ class RecordBatcher {
   thread::ThreadPool* processor_thread_ = nullptr;
   thread::ThreadPool* merger_thread_ = nullptr;
   Mutex mu_;
-  int64 curr_bucket_ GUARDED_BY(mu_) = -1;
-  TensorVec curr_ GUARDED_BY(mu_);
+  // Merged batches, paired with their bucket ids, waiting to be returned by
+  // GetNext().
+  std::deque<std::pair<int64, TensorVec>> curr_ GUARDED_BY(mu_);
 
   // True if either the yielder hits EOF or the destructor triggers.
   bool stop_ GUARDED_BY(mu_) = false;
@@ -130,7 +137,7 @@ class RecordBatcher {
   // True when the merger thread is finished.
   bool merger_loop_done_ GUARDED_BY(mu_) = false;
 
-  Condition curr_empty_;
+  Condition curr_has_room_;
   Condition curr_non_empty_;
   int64 records_yielded_ GUARDED_BY(mu_) = 0;
   int64 total_records_yielded_ GUARDED_BY(mu_) = 0;
@@ -148,9 +155,10 @@ class RecordBatcher {
   std::vector<int64> bucket_upper_bound_;
 
   // Conditions.
-  bool CurrEmpty() const SHARED_LOCKS_REQUIRED(mu_) {
+  bool CurrHasRoom() const SHARED_LOCKS_REQUIRED(mu_) {
     return ((stop_ && stop_status_.ok()) ||  // The object is being destroyed
-            curr_.empty());                  // We can push work onto curr_.
+            // We can push work onto curr_.
+            static_cast<int64>(curr_.size()) < opts_.prefetch_buffer_size);
   }
 
   bool CurrNonEmpty() const SHARED_LOCKS_REQUIRED(mu_) {
@@ -180,7 +188,7 @@ class RecordBatcher {
   void IncrementHistogram(int64 bucket) EXCLUSIVE_LOCKS_REQUIRED(mu_);
 
   // For performance debugging.
-  void WaitForCurrEmpty() EXCLUSIVE_LOCKS_REQUIRED(mu_);
+  void WaitForCurrHasRoom() EXCLUSIVE_LOCKS_REQUIRED(mu_);
   void WaitForCurrNonEmpty() EXCLUSIVE_LOCKS_REQUIRED(mu_);
   void WaitForToFlushEmpty() EXCLUSIVE_LOCKS_REQUIRED(mu_);
   void WaitForToFlushNonEmpty() EXCLUSIVE_LOCKS_REQUIRED(mu_);
@@ -252,6 +252,44 @@ TEST(RecordBatcher, FullEpoch) {
   }
 }
 
+TEST(RecordBatcher, FullEpochWithPrefetch) {
+  const int N = 1000;
+  const string filename = io::JoinPath("/tmp", "full_epoch_prefetch");
+  GenerateTestData(filename, N, false /* random_value */);
+
+  BasicRecordYielder::Options yopts;
+  yopts.file_pattern = strings::StrCat("tfrecord:", filename);
+  yopts.seed = 301;
+  yopts.bufsize = 10;
+  yopts.parallelism = 1;
+
+  RecordBatcher::Options bopts;
+  bopts.bucket_upper_bound = {20, 50, 90, 120};
+  bopts.bucket_batch_limit = {8, 4, 2, 1};
+  bopts.flush_every_n = N;  // Same number of records in the data file.
+  bopts.prefetch_buffer_size = 4;
+
+  RecordBatcher batcher(bopts, BasicRecordYielder::New(yopts), new TestRP());
+  int64 bucket_id;
+  TensorVec batch;
+  std::vector<string> records;
+  while (records.size() < N) {
+    TF_CHECK_OK(batcher.GetNext(&bucket_id, &batch));
+    ASSERT_LE(0, bucket_id);
+    ASSERT_LT(bucket_id, bopts.bucket_upper_bound.size());
+    const Tensor& t = batch[0];
+    for (int j = 0; j < t.dim_size(0); ++j) {
+      records.push_back(t.vec<string>()(j));
+    }
+  }
+  ASSERT_EQ(N, records.size());
+  // Prefetching must neither drop nor duplicate batches.
+  std::sort(records.begin(), records.end());
+  for (int i = 0; i < N; ++i) {
+    EXPECT_EQ(strings::Printf("%010d", i), records[i]);
+  }
+}
+
 TEST(RecordBatcher, CaptureYielderStatus) {
   const int N = 50;
   const string filename = io::JoinPath("/tmp", "full_epoch");
@@ -32,12 +32,12 @@ void BasicRecordYielder::WaitForBufEnough() {
   }
 }
 
-void RecordBatcher::WaitForCurrEmpty() {
-  if (!CurrEmpty()) {
+void RecordBatcher::WaitForCurrHasRoom() {
+  if (!CurrHasRoom()) {
     auto start = Env::Default()->NowMicros();
-    mu_.Await(curr_empty_);
+    mu_.Await(curr_has_room_);
     VLOG(2)
-        << "Wait for curr empty: "
+        << "Wait for room in curr: "
         << (Env::Default()->NowMicros() - start) * 1e-6
         << " Hint: Processing is not fast enough to consume example batches.";
   }
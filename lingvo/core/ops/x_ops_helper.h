@@ -31,6 +31,7 @@ limitations under the License.
       .Attr("require_sequential_order: bool = False") \
       .Attr("repeat_count: int = -1")                 \
       .Attr("use_chaining: bool = False")             \
+      .Attr("prefetch_buffer_size: int = 1")          \
       .SetIsStateful()
 
 #define INPUT_DOCS \
@@ -45,6 +46,7 @@ input_source_weights: A list of input sources weights that control the input\
 file_random_seed: Random seeds used to produce randomized records.\
 file_buffer_size: The randomization shuffling buffer.\
 file_parallelism: How many sstables are opened and concurrently iterated over.\
+  A negative value uses the number of schedulable CPUs on the host.\
 bucket_upper_bound: Bucketing scheme. Specifies each bucket's upper bound.\
 bucket_batch_limit: Batching scheme. Specifies each bucket's maximum batch\
   size.\
@@ -66,6 +68,9 @@ use_chaining: If true, the input op is outputing records from file patterns in \
   order. That is, first all records from first file pattern will be yielded, \
   then all records from the second file pattern and so on. If false, the \
   records from different file patterns will be mixed.\
+prefetch_buffer_size: Number of merged batches buffered ahead of the consumer.\
+  Larger values let the batcher run ahead of the trainer at the cost of\
+  holding more batches in memory.\
 )"
 
 #endif  // LINGVO_CORE_OPS_X_OPS_HELPER_H_
@@ -333,6 +333,33 @@ def GetRank(tensor):
     return tf.rank(tensor)  # Tensor
 
 
+def _IsStaticShapeMatch(tensor, expected_shape, ndims=None):
+  """Returns True if tensor's static shape is known to match expected_shape.
+
+  Args:
+    tensor: A Tensor.
+    expected_shape: A Python list or a 1D tensor. -1 matches any dimension.
+    ndims: If not None, check only the first `ndims` dimensions of `tensor`.
+
+  Returns:
+    True if the match is established at graph construction time. False if the
+    shapes mismatch or if only a runtime check can tell.
+  """
+  if not isinstance(tensor, tf.Tensor):
+    return False
+  if not isinstance(expected_shape, (list, tuple)):
+    return False
+  if not all(isinstance(d, six.integer_types) for d in expected_shape):
+    return False
+  if tensor.shape.ndims is None:
+    return False
+  actual_shape = tensor.shape.as_list()[:ndims]
+  if len(actual_shape) != len(expected_shape):
+    return False
+  return all(expected == -1 or actual == expected
+             for actual, expected in zip(actual_shape, expected_shape))
+
+
 def HasShape(tensor, expected_shape, ndims=None):
   """Syntactic sugar for asserting that tensor has the expected shape.
 
@@ -348,6 +375,9 @@ def HasShape(tensor, expected_shape, ndims=None):
     A runtime error if the assertion fails.
   """
   if FLAGS.enable_asserts:
+    if _IsStaticShapeMatch(tensor, expected_shape, ndims):
+      # The static shape already matches, so no runtime assertion is needed.
+      return tensor
     filepath, line, func, _ = traceback.extract_stack(limit=3)[-2]
     msg = 'LINGVO ASSERT %s:%s(%s)' % (re.sub(r'.*/', '',
                                                  filepath), line, func)
@@ -2849,6 +2879,23 @@ def PadOrTrimTo(x, shape, pad_val=0):
     'x' is padded with pad_val and sliced so that the result has the given
     shape.
   """
+  if isinstance(shape, tf.TensorShape) and shape.is_fully_defined():
+    shape = shape.as_list()
+  if (isinstance(shape, (list, tuple)) and
+      all(isinstance(dim, numbers.Integral) for dim in shape) and
+      x.shape.is_fully_defined()):
+    # Both shapes are static: compute the paddings and the slice in Python and
+    # only emit the ops that are actually needed.
+    x_shape = x.shape.as_list()
+    assert len(x_shape) == len(shape), (
+        'Ranks did not match, got %d, expected %d' % (len(x_shape), len(shape)))
+    paddings = [[0, max(dim - x_dim, 0)] for x_dim, dim in zip(x_shape, shape)]
+    if any(pad for _, pad in paddings):
+      x = tf.pad(x, paddings, constant_values=pad_val)
+    if any(x_dim > dim for x_dim, dim in zip(x_shape, shape)):
+      x = tf.slice(x, [0] * len(shape), shape)
+    return x
+
   if isinstance(shape, (list, tuple)):
     expected_rank = len(shape)
   elif isinstance(shape, tf.TensorShape):
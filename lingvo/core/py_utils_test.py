@@ -361,6 +361,22 @@ class PyUtilsTest(test_utils.TestCase):
     self.assertAllEqual(read_x, [[1, 2], [3, 4]])
     self.assertAllEqual(read_y, [10] * 4)
 
+  def testHasShape(self):
+    with self.session(graph=tf.Graph()) as sess:
+      a = tf.zeros([2, 3])
+      # A statically matching shape returns the tensor itself, without a
+      # runtime assertion.
+      self.assertIs(py_utils.HasShape(a, [2, 3]), a)
+      self.assertIs(py_utils.HasShape(a, [-1, 3]), a)
+      self.assertIs(py_utils.HasShape(a, [2], ndims=1), a)
+
+      b = tf.placeholder(tf.float32, shape=(None, 3))
+      b_checked = py_utils.HasShape(b, [2, 3])
+      self.assertIsNot(b_checked, b)
+      sess.run(b_checked, {b: np.zeros([2, 3])})
+      with self.assertRaisesRegexp(tf.errors.InvalidArgumentError, 'mismatch'):
+        sess.run(b_checked, {b: np.zeros([4, 3])})
+
   def testGetShape(self):
     a = tf.constant([1])
     self.assertEqual(py_utils.GetShape(a), [1])
@@ -1381,6 +1397,25 @@ class PadOrTrimToTest(test_utils.TestCase):
       ]
       self.assertAllClose(expected_x, real_x)
 
+  def test2DStaticShapeNoop(self):
+    with self.session(use_gpu=False, graph=tf.Graph()):
+      x = tf.random_normal(shape=(3, 3), seed=123456)
+      padded_x = py_utils.PadOrTrimTo(x, [3, 3], pad_val=0)
+      # No pad or slice is needed when the shapes already match.
+      self.assertIs(padded_x, x)
+
+  def test2DStaticShapePadAndTrim(self):
+    with self.session(use_gpu=False, graph=tf.Graph()) as sess:
+      x = tf.random_normal(shape=(3, 3), seed=123456)
+      padded_x = py_utils.PadOrTrimTo(x, [2, 4], pad_val=-1)
+      self.assertEqual(padded_x.shape.as_list(), [2, 4])
+      real_x = sess.run(padded_x)
+      expected_x = [
+          [0.38615, 2.975221, -0.852826, -1.],
+          [-0.571142, -0.432439, 0.413158, -1.],
+      ]
+      self.assertAllClose(expected_x, real_x)
+
   def test4D(self):
     with self.session(use_gpu=False, graph=tf.Graph()) as sess:
       x = tf.random_normal(shape=(2, 2, 2, 2), seed=123456)
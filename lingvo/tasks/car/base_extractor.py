@@ -87,6 +87,17 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
         'preprocessors.')
     p.Define('record_type', 'EXAMPLE',
              'Raw record format, default to tf.Example.')
+    p.Define(
+        'jit_preprocess', False,
+        'If True, the preprocessors are compiled with XLA so that ops across '
+        'preprocessors can be fused. All preprocessors must then produce '
+        'XLA-compatible ops with static shapes.')
+    p.Define(
+        'always_run_preprocessors', False,
+        'If True, the preprocessors run on every example, including the ones '
+        'the extractors filter out, so no tf.cond is built around them. Only '
+        'set this when all preprocessors can handle examples that failed '
+        'filtering.')
 
     p.batch_size = 64
     p.use_per_host_infeed = True
@@ -108,6 +119,16 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
       self.CreateChild(name, eparam)
       self._extractors[name] = self.children[name]
 
+    if p.record_type not in _PARSING_FUNCTIONS:
+      raise ValueError('Invalid record_type: {}'.format(p.record_type))
+    self._parsing_fn = _PARSING_FUNCTIONS[p.record_type]
+
+    # The parsing schema is the union of every extractor's FeatureMap(), and is
+    # fixed once the extractors are instantiated.
+    self._feature_map = {}
+    for extractor in self._extractors.Flatten():
+      self._feature_map.update(extractor.FeatureMap())
+
     # Instantiate preprocessors based on their ordering.
     flattened_processors = dict(p.preprocessors.IterParams())
 
@@ -121,6 +142,14 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
     preprocessors = [flattened_processors[key] for key in p.preprocessors_order]
     self.CreateChildren('preprocessors', preprocessors)
 
+    # Output shapes and dtypes only depend on the params of the extractors and
+    # preprocessors, so they are computed once here.
+    self._shapes = self._extractors.Transform(lambda x: x.Shape())
+    self._dtypes = self._extractors.Transform(lambda x: x.DType())
+    for preprocessor in self.preprocessors:
+      self._shapes = preprocessor.TransformShapes(self._shapes)
+      self._dtypes = preprocessor.TransformDTypes(self._dtypes)
+
     dtypes = self.DType()
     shapes = self.Shape()
     if not dtypes.IsCompatible(shapes):
@@ -128,17 +157,18 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
                                           shapes.DebugString()))
     dtypes.Pack(zip(dtypes.Flatten(), shapes.Flatten())).VLog(0, 'InpGen: ')
 
+    # (name, dtype, shape) of every flattened output, in the order they are
+    # produced by generic_input_op.
+    self._flat_output_specs = [
+        (name, dtype, shape)
+        for (name, dtype), shape in zip(dtypes.FlattenItems(), shapes.Flatten())
+    ]
+
   def Shape(self):
-    shapes = self._extractors.Transform(lambda x: x.Shape())
-    for preprocessor in self.preprocessors:
-      shapes = preprocessor.TransformShapes(shapes)
-    return shapes
+    return self._shapes.DeepCopy()
 
   def DType(self):
-    dtypes = self._extractors.Transform(lambda x: x.DType())
-    for preprocessor in self.preprocessors:
-      dtypes = preprocessor.TransformDTypes(dtypes)
-    return dtypes
+    return self._dtypes.DeepCopy()
 
   @property
   def class_names(self):
@@ -147,7 +177,14 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
   def _DataSourceFromFilePattern(self, file_pattern):
 
     def Proc(record):
-      """Parses a serialized tf.Example record."""
+      """Parses a serialized tf.Example record.
+
+      Args:
+        record: A scalar string Tensor holding one serialized record.
+
+      Returns:
+        A tuple of (flattened output Tensors, bucket id).
+      """
       bucket, outputs = self.ExtractUsingExtractors(record)
       return outputs.Flatten(), bucket
 
@@ -167,32 +204,29 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
       A tuple of tensors:
 
       - bucket_id: A scalar int Tensor.
-      - extracted: a NestedMap of Tensors extracted.
+      - extracted: a NestedMap of Tensors extracted. Unless
+        p.always_run_preprocessors is set, these have no static shape: examples
+        that are filtered out produce empty Tensors (see NullLike below).
+        Callers must not rely on static shapes; the only caller,
+        generic_input, drops them anyway and _NestedMapFromBatchedOutputs
+        restores the declared Shape() by padding the batched outputs.
     """
-    feature_map = {}
-    self._extractors.Transform(lambda e: feature_map.update(e.FeatureMap()))
+    features = self._parsing_fn(record, self._feature_map)
 
-    if self.params.record_type not in _PARSING_FUNCTIONS:
-      raise ValueError('Invalid record_type: {}'.format(
-          self.params.record_type))
-    parsing_fn = _PARSING_FUNCTIONS[self.params.record_type]
-    features = parsing_fn(record, feature_map)
-
-    def ExtractAndFilter(e):
+    buckets = []
+    extracted = []
+    for e in self._extractors.Flatten():
       with tf.name_scope(e.params.name):
         with tf.name_scope('extract'):
-          extracted = e.Extract(features)
+          e_extracted = e.Extract(features)
         with tf.name_scope('filter'):
-          bucket = e.Filter(extracted)
-      return bucket, extracted
-
-    bucket_extracted = self._extractors.Transform(ExtractAndFilter)
-    buckets = bucket_extracted.Transform(lambda x: x[0])
-    extracted = bucket_extracted.Transform(lambda x: x[1])
+          buckets.append(e.Filter(e_extracted))
+      extracted.append(e_extracted)
+    extracted = self._extractors.Pack(extracted)
 
     # Return the maximum bucket id so that any extractor can decide whether
     # to filter the entire example.
-    max_bucket = tf.reduce_max(buckets.Flatten())
+    max_bucket = tf.reduce_max(buckets)
 
     def NullLike():
       """A function to return the same Tensor signature as Preprocess.
@@ -202,23 +236,32 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
       limit; tf.cond() requires that the output of both branches yields the same
       structure.
 
+      The dropped example never reaches a batch, so every tensor is empty
+      (zero-sized along each dimension) instead of a zero-filled tensor of the
+      full declared shape. The two tf.cond() branches therefore only agree on
+      dtype and rank, and the static dims of the tf.cond() outputs are lost.
+
       Returns:
-        A structure with the same Tensor dtype and shape as the output of
-        Preprocess.
+        A structure with the same Tensor dtype and rank as the output of
+        Preprocess, but not the same shape.
       """
       shapes = self.Shape()
       rets = [
-          tf.zeros(dtype=dtype, shape=shape)
+          tf.zeros(dtype=dtype, shape=[0] * shape.rank)
           for (dtype, shape) in zip(self.DType().Flatten(), shapes.Flatten())
       ]
       return shapes.Pack(rets)
 
     def Preprocess(extracted):
-      for key, preprocessor in zip(self.params.preprocessors_order,
-                                   self.preprocessors):
-        with tf.name_scope(key), tf.name_scope(preprocessor.params.name):
-          extracted = preprocessor.TransformFeatures(extracted)
-      return extracted
+      if self.params.jit_preprocess:
+        with tf.xla.experimental.jit_scope():
+          return self._ApplyPreprocessors(extracted)
+      return self._ApplyPreprocessors(extracted)
+
+    if self.params.always_run_preprocessors:
+      # Examples at or above BUCKET_UPPER_BOUND are dropped by generic_input
+      # based on max_bucket alone, so their outputs need no masking.
+      return max_bucket, Preprocess(extracted)
 
     # If the extractor wants to filter the example, don't run the preprocessor.
     #
@@ -230,6 +273,14 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
 
     return max_bucket, final_output
 
+  def _ApplyPreprocessors(self, extracted):
+    """Applies the preprocessors to 'extracted' in preprocessors_order."""
+    for key, preprocessor in zip(self.params.preprocessors_order,
+                                 self.preprocessors):
+      with tf.name_scope(key), tf.name_scope(preprocessor.params.name):
+        extracted = preprocessor.TransformFeatures(extracted)
+    return extracted
+
   def InputBatch(self):
     batched_outputs, bucket_keys = self._BuildDataSource()
     ret = self._NestedMapFromBatchedOutputs(batched_outputs)
@@ -241,19 +292,19 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
     batch_size = self.InfeedBatchSize()
     shapes = self.Shape()
     shapes.VLog(0, 'input extractor shape: ')
-    flatten_shapes = shapes.Flatten()
-    dtypes = self.DType()
-    flatten_dtypes = dtypes.FlattenItems()
-    assert len(flatten_shapes) == len(outputs), '{} vs. {}'.format(
-        len(flatten_shapes), len(outputs))
-    assert len(flatten_dtypes) == len(outputs), '{} vs. {}'.format(
-        len(flatten_dtypes), len(outputs))
+    assert len(self._flat_output_specs) == len(outputs), '{} vs. {}'.format(
+        len(self._flat_output_specs), len(outputs))
 
+    use_tpu = py_utils.use_tpu()
     rets = []
-    for (output, (name, dtype), shape) in zip(outputs, flatten_dtypes,
-                                              flatten_shapes):
+    for output, (name, dtype, shape) in zip(outputs, self._flat_output_specs):
       assert dtype == output.dtype, '{}: {} vs. {}'.format(
           name, dtype, output.dtype)
+      if use_tpu and dtype == tf.string:
+        # tf.string tensors are not supported on TPUs and are dropped below,
+        # so don't bother padding them.
+        rets += [None]
+        continue
       # Pad every output to make shapes fixed according to the corresponding
       # declared shape, since the shapes of outputs are lost through
       # generic_input_op.
@@ -265,7 +316,7 @@ class _BaseExtractor(base_input_generator.BaseInputGeneratorFromFiles):
       rets += [padded]
 
     rets = shapes.Pack(rets)
-    if py_utils.use_tpu():
+    if use_tpu:
       # Drops tf.string tensors, which is not supported on TPUs.
-      rets = rets.Filter(lambda x: x.dtype != tf.string)
+      rets = rets.Filter(lambda x: x is not None)
     return rets
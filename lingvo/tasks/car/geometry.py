@@ -33,7 +33,39 @@ from __future__ import print_function
 import lingvo.compat as tf
 from lingvo.core import py_utils
 import numpy as np
-from tensorflow.python.ops import functional_ops
+
+
+# Linear maps between the (ymin, xmin, ymax, xmax) and (x, y, w, h) bbox
+# representations, applied as bboxes * matrix.
+_XYWH_TO_BBOXES = np.array([
+    # x    y    h    w
+    [0.0, 1.0, 0.0, -.5],  # ymin
+    [1.0, 0.0, -.5, 0.0],  # xmin
+    [0.0, 1.0, 0.0, 0.5],  # ymax
+    [1.0, 0.0, 0.5, 0.0],  # xmax
+]).T
+
+_BBOXES_TO_XYWH = np.array([
+    # ymin xmin ymax xmax
+    [0.0, 0.5, 0.0, 0.5],  # x centroid
+    [0.5, 0.0, 0.5, 0.0],  # y centroid
+    [0.0, -1., 0.0, 1.0],  # width
+    [-1., 0.0, 1.0, 0.0],  # height
+]).T
+
+
+# Corners in normalized box frame (unit cube centered at origin), in the order
+# returned by BBoxCorners.
+_UNIT_CUBE_CORNERS = np.array([
+    [0.5, 0.5, 0.5],  # top
+    [-0.5, 0.5, 0.5],  # top
+    [-0.5, -0.5, 0.5],  # top
+    [0.5, -0.5, 0.5],  # top
+    [0.5, 0.5, -0.5],  # bottom
+    [-0.5, 0.5, -0.5],  # bottom
+    [-0.5, -0.5, -0.5],  # bottom
+    [0.5, -0.5, -0.5],  # bottom
+])
 
 
 def _BroadcastMatmul(x, y):
@@ -47,11 +79,7 @@ def _BroadcastMatmul(x, y):
     Tensor: ``z[..., c]``, where ``z[i..., :] = matmul(x[i..., :], y)``
   """
   y = py_utils.HasRank(y, 2)
-  x_reshaped = tf.reshape(x, [-1, tf.shape(x)[-1]])
-  result = tf.matmul(x_reshaped, y)
-  return tf.reshape(result,
-                    tf.concat(
-                        [tf.shape(x)[:-1], tf.shape(y)[-1:]], axis=0))
+  return tf.einsum('...b,bc->...c', x, y)
 
 
 def CoordinateTransform(points, pose):
@@ -78,36 +106,32 @@ def CoordinateTransform(points, pose):
   translation = tf.reshape([translate_x, translate_y, translate_z], shape=[3])
   translated_points = points + translation
 
-  # Define the rotation matrices for each of yaw, roll and pitch.
-  #
-  # The angle is expected to be in radians.
-  # pyformat: disable
-  def UnitX(angle):
-    return tf.reshape([1., 0., 0.,
-                       0., tf.cos(angle), -tf.sin(angle),
-                       0., tf.sin(angle), tf.cos(angle)],
-                      shape=[3, 3])
-
-  def UnitY(angle):
-    return tf.reshape([tf.cos(angle), 0., tf.sin(angle),
-                       0., 1., 0.,
-                       -tf.sin(angle), 0., tf.cos(angle)],
-                      shape=[3, 3])
-
-  def UnitZ(angle):
-    return tf.reshape([tf.cos(angle), -tf.sin(angle), 0.,
-                       tf.sin(angle), tf.cos(angle), 0.,
-                       0., 0., 1.],
-                      shape=[3, 3])
-  # pyformat: enable
-
   # Compose the rotations along the three axes.
   #
-  # Yaw->Z, Roll->X, Pitch->Y to match onboard logic:
+  # Yaw->Z, Roll->X, Pitch->Y to match onboard logic. The composed rotation
+  # Rz(yaw) * Rx(roll) * Ry(pitch) is written out in closed form so that it is
+  # built from a single stack instead of three matrices and two matmuls.
+  #
+  # The angles are expected to be in radians.
   yaw = pose[3]
   roll = pose[4]
   pitch = pose[5]
-  rotation_matrix = tf.matmul(tf.matmul(UnitZ(yaw), UnitX(roll)), UnitY(pitch))
+  cos_yaw, sin_yaw = tf.cos(yaw), tf.sin(yaw)
+  cos_roll, sin_roll = tf.cos(roll), tf.sin(roll)
+  cos_pitch, sin_pitch = tf.cos(pitch), tf.sin(pitch)
+  # pyformat: disable
+  rotation_matrix = tf.reshape(tf.stack([
+      cos_yaw * cos_pitch - sin_yaw * sin_roll * sin_pitch,
+      -sin_yaw * cos_roll,
+      cos_yaw * sin_pitch + sin_yaw * sin_roll * cos_pitch,
+      sin_yaw * cos_pitch + cos_yaw * sin_roll * sin_pitch,
+      cos_yaw * cos_roll,
+      sin_yaw * sin_pitch - cos_yaw * sin_roll * cos_pitch,
+      -cos_roll * sin_pitch,
+      sin_roll,
+      cos_roll * cos_pitch,
+  ]), shape=[3, 3])
+  # pyformat: enable
 
   # Finally, rotate the points about the pose's origin according to the
   # rotation matrix.
@@ -117,15 +141,7 @@ def CoordinateTransform(points, pose):
 
 def XYWHToBBoxes(xywh):
   """Converts xywh to bboxes."""
-  mtrx = tf.constant(
-      np.array([
-          # x    y    h    w
-          [0.0, 1.0, 0.0, -.5],  # ymin
-          [1.0, 0.0, -.5, 0.0],  # xmin
-          [0.0, 1.0, 0.0, 0.5],  # ymax
-          [1.0, 0.0, 0.5, 0.0],  # xmax
-      ]).T,
-      dtype=xywh.dtype)
+  mtrx = tf.constant(_XYWH_TO_BBOXES, dtype=xywh.dtype)
   return _BroadcastMatmul(xywh, mtrx)
 
 
@@ -147,13 +163,13 @@ def PointsToImagePlane(points, velo_to_image_plane):
   points = py_utils.HasShape(points, [num_points, 3])
   velo_to_image_plane = py_utils.HasShape(velo_to_image_plane, [3, 4])
 
-  # Add homogenous coordinates to points.
-  points = tf.concat([points, tf.ones((num_points, 1))], axis=-1)
-
   # Perform projection and divide by last coordinate to recover 2D pixel
-  # locations.
-  points_image = tf.matmul(points, velo_to_image_plane, transpose_b=True)
-  points_image = points_image[:, :2] / points_image[:, 2:3]
+  # locations. Rather than appending homogenous coordinates to points, the
+  # last column of velo_to_image_plane is added as a translation.
+  points_image = tf.matmul(
+      points, velo_to_image_plane[:, :3],
+      transpose_b=True) + velo_to_image_plane[:, 3]
+  points_image = points_image[:, :2] * tf.math.reciprocal(points_image[:, 2:3])
 
   points_image = py_utils.HasShape(points_image, [num_points, 2])
   return points_image
@@ -161,30 +177,53 @@ def PointsToImagePlane(points, velo_to_image_plane):
 
 def BBoxesToXYWH(bboxes):
   """Converts bboxes to xywh."""
-  mtrx = tf.constant(
-      np.array([
-          # ymin xmin ymax xmax
-          [0.0, 0.5, 0.0, 0.5],  # x centroid
-          [0.5, 0.0, 0.5, 0.0],  # y centroid
-          [0.0, -1., 0.0, 1.0],  # width
-          [-1., 0.0, 1.0, 0.0],  # height
-      ]).T,
-      dtype=bboxes.dtype)
+  mtrx = tf.constant(_BBOXES_TO_XYWH, dtype=bboxes.dtype)
   return _BroadcastMatmul(bboxes, mtrx)
 
 
 def BBoxesCentroid(bboxes):
   """Returns the centroids of bboxes."""
-  mtrx = tf.constant(
-      np.array([
-          # ymin xmin ymax xmax
-          [0.0, 0.5, 0.0, 0.5],  # x centroid
-          [0.5, 0.0, 0.5, 0.0],  # y centroid
-      ]).T,
-      dtype=bboxes.dtype)
+  # The centroid is given by the first two columns of _BBOXES_TO_XYWH.
+  mtrx = tf.constant(_BBOXES_TO_XYWH[:, :2], dtype=bboxes.dtype)
   return _BroadcastMatmul(bboxes, mtrx)
 
 
+def _ReorderIndicesByPhiNonEmpty(anchor, bboxes):
+  """ReorderIndicesByPhi for a non-empty bboxes."""
+  n = tf.shape(bboxes)[0]
+  centroid = BBoxesCentroid(bboxes)
+
+  # Computed dot products between centroid and the anchor point.
+  dot = tf.squeeze(tf.matmul(centroid, tf.expand_dims(anchor, 1)), axis=1)
+
+  # Normalize dot to get the cosine of the angles. The product of the squared
+  # norms is normalized with a single rsqrt.
+  squared_norm = (
+      tf.reduce_sum(tf.square(anchor)) *
+      tf.reduce_sum(tf.square(centroid), axis=1))
+  cosine = tf.where(
+      tf.greater(squared_norm, 0), dot * tf.math.rsqrt(squared_norm),
+      tf.zeros([n], squared_norm.dtype))
+
+  # Disambiguates the angle anchor--O--point is positive or negative by the
+  # sign of cross products between angle and points. Both vectors lie in the
+  # xy plane, so only the z component of the cross product is non-zero.
+  cross_z = anchor[0] * centroid[:, 1] - anchor[1] * centroid[:, 0]
+
+  # If the sign is positive, the points lie on the clockwise side of
+  # O-->anchor. Hence, -1 - cosine moves the cosine values to [-2, 0].  If the
+  # sign is negative, the points lie on the counter-clockwise side of
+  # O-->anchor. 1 + cosine moves the cosine values to [0, 2].
+  #
+  # The car dataset shows that the points are scanned in the counter-clockwise
+  # fashion. Therefore, top-k orders the points in the same order in which
+  # bboxes appears in the spin.
+  score = tf.where(tf.greater(cross_z, 0), -1 - cosine, 1 + cosine)
+
+  _, indices = tf.nn.top_k(score, n, sorted=True)
+  return indices
+
+
 def ReorderIndicesByPhi(anchor, bboxes):
   """Sort bboxes based their angles relative to the anchor point.
 
@@ -196,56 +235,33 @@ def ReorderIndicesByPhi(anchor, bboxes):
     A permutation of tf.range(n) which can be used to reshuffle bboxes to the
     sorted order. (e.g., tf.gather(bboxes, indices)).
   """
+  anchor = tf.convert_to_tensor(anchor)
+  bboxes = tf.convert_to_tensor(bboxes)
 
-  @tf.Defun(anchor.dtype, bboxes.dtype)
-  def _True(anchor, bboxes):
+  def _True():
     """True branch when num of bboxes is non-zero."""
-    n = tf.shape(bboxes)[0]
-    centroid = BBoxesCentroid(bboxes)
-
-    # Computed dot products between centroid and the anchor point.
-    dot = tf.squeeze(tf.matmul(centroid, tf.expand_dims(anchor, 1)), axis=1)
-
-    # Normalize dot to get the cosine of the angles.
-    norm = tf.norm(anchor) * tf.norm(centroid, axis=1)
-    cosine = tf.where(
-        tf.greater(norm, 0), dot / norm, tf.zeros([n], norm.dtype))
-
-    # Disambiguates the angle anchor--O--point is positive or negative by the
-    # sign of cross products between angle and points.  tf.cross takes 3-vector
-    # (x, y, z), so we set z to 0.  tf.cross does not support broadcasting, so
-    # we tile anchor to shape [n, 3].
-    cross = tf.cross(
-        tf.tile(tf.pad(tf.expand_dims(anchor, 0), [[0, 0], [0, 1]]), [n, 1]),
-        tf.pad(centroid, [[0, 0], [0, 1]]))
-
-    # If the sign is positive, the points lie on the clockwise side of
-    # O-->anchor. Hence, -1 - cosine moves the cosine values to [-2, 0].  If the
-    # sign is negative, the points lie on the counter-clockwise side of
-    # O-->anchor. 1 + cosine moves the cosine values to [0, 2].
-    #
-    # The car dataset shows that the points are scanned in the counter-clockwise
-    # fashion. Therefore, top-k orders the points in the same order in which
-    # bboxes appears in the spin.
-    score = tf.where(tf.greater(cross, 0)[:, 2], -1 - cosine, 1 + cosine)
-
-    _, indices = tf.nn.top_k(score, n, sorted=True)
-    return indices
-
-  @tf.Defun(anchor.dtype, bboxes.dtype)
-  def _False(anchor, bboxes):
-    del anchor, bboxes
+    return _ReorderIndicesByPhiNonEmpty(anchor, bboxes)
+
+  def _False():
     return tf.zeros([0], dtype=tf.int32)
 
-  n = tf.shape(bboxes)[0]
-  return functional_ops.If(tf.greater(n, 0), [anchor, bboxes], _True, _False)[0]
+  n = py_utils.GetShape(bboxes, 1)[0]
+  if not isinstance(n, tf.Tensor):
+    # The number of bboxes is known statically, so the branch is picked here.
+    return _True() if n > 0 else _False()
+  return tf.cond(tf.greater(n, 0), _True, _False)
 
 
 def _SmoothL1Norm(a):
   """Smoothed L1 norm."""
   # F&F paper formula (3).
   # http://openaccess.thecvf.com/content_cvpr_2018/papers/Luo_Fast_and_Furious_CVPR_2018_paper.pdf
-  return tf.where(tf.abs(a) < 1, 0.5 * tf.square(a), tf.abs(a) - 0.5)
+  #
+  # Computed without tf.where as 0.5 * c^2 + (|a| - c) with c = min(|a|, 1),
+  # which is 0.5 * a^2 when |a| < 1 and |a| - 0.5 otherwise.
+  abs_a = tf.abs(a)
+  clipped = tf.minimum(abs_a, 1.)
+  return 0.5 * tf.square(clipped) + (abs_a - clipped)
 
 
 def DistanceBetweenCentroidsAndBBoxesFastAndFurious(centroids, bboxes, masks):
@@ -272,13 +288,19 @@ def DistanceBetweenCentroidsAndBBoxesFastAndFurious(centroids, bboxes, masks):
   def Pos(x):
     return tf.maximum(tf.constant(1e-8, x.dtype), x)
 
-  # The following terms are zeros when masks[i] is 0.
-  l_x = py_utils.CheckNumerics(masks * (x - x_gt) / Pos(w_gt))
-  l_y = py_utils.CheckNumerics(masks * (y - y_gt) / Pos(h_gt))
-  s_w = py_utils.CheckNumerics(masks * tf.log(Pos(w) / Pos(w_gt)))
-  s_h = py_utils.CheckNumerics(masks * tf.log(Pos(h) / Pos(h_gt)))
-  return (_SmoothL1Norm(l_x) + _SmoothL1Norm(l_y) + _SmoothL1Norm(s_w) +
-          _SmoothL1Norm(s_h))
+  # The 4 terms l_x, l_y, s_w and s_h are stacked along the last axis so that
+  # the mask and the smooth L1 norm are applied to all of them at once. They
+  # are zeros when masks[i] is 0.
+  deltas = tf.stack(
+      [
+          (x - x_gt) / Pos(w_gt),
+          (y - y_gt) / Pos(h_gt),
+          tf.log(Pos(w) / Pos(w_gt)),
+          tf.log(Pos(h) / Pos(h_gt)),
+      ],
+      axis=-1)
+  deltas = py_utils.CheckNumerics(tf.expand_dims(masks, -1) * deltas)
+  return tf.reduce_sum(_SmoothL1Norm(deltas), axis=-1)
 
 
 def DistanceBetweenCentroids(u, v, masks):
@@ -313,7 +335,7 @@ def _IsOnLeftHandSideOrOn(point, v1, v2):
     A tensor of booleans indicating whether each point is on the left
     of, or exactly on, the direction indicated by the vertices.
   """
-  v1 = py_utils.HasShape(v1, tf.shape(v2))
+  v1 = py_utils.HasShape(v1, py_utils.GetShape(v2))
   point_x = point[..., 0]
   point_y = point[..., 1]
   v1_x = v1[..., 0]
@@ -351,8 +373,8 @@ def _IsCounterClockwiseDirection(v1, v2, v3):
   direction.
   """
   # Check if it's on the left hand side, strictly, and without broadcasting.
-  v1 = py_utils.HasShape(v1, tf.shape(v2))
-  v1 = py_utils.HasShape(v1, tf.shape(v3))
+  v1 = py_utils.HasShape(v1, py_utils.GetShape(v2))
+  v1 = py_utils.HasShape(v1, py_utils.GetShape(v3))
   v1_x, v1_y = v1[..., 0], v1[..., 1]
   v2_x, v2_y = v2[..., 0], v2[..., 1]
   v3_x, v3_y = v3[..., 0], v3[..., 1]
@@ -399,13 +421,15 @@ def IsWithinBBox(points, bbox):
       py_utils.Assert(v4v1v2_check, [v4, v1, v2]),
       py_utils.Assert(v3v4v1_check, [v3, v4, v1])
   ]):
-    is_inside = tf.logical_and(
-        tf.logical_and(
-            _IsOnLeftHandSideOrOn(points, v1, v2),
-            _IsOnLeftHandSideOrOn(points, v2, v3)),
-        tf.logical_and(
-            _IsOnLeftHandSideOrOn(points, v3, v4),
-            _IsOnLeftHandSideOrOn(points, v4, v1)))
+    # Test all 4 edges (v1, v2), (v2, v3), (v3, v4) and (v4, v1) at once by
+    # stacking them along the second to last axis, which is then broadcast
+    # against a new axis on points.
+    edge_starts = bbox
+    edge_ends = tf.concat([bbox[..., 1:, :], bbox[..., :1, :]], axis=-2)
+    is_inside = tf.reduce_all(
+        _IsOnLeftHandSideOrOn(
+            tf.expand_dims(points, -2), edge_starts, edge_ends),
+        axis=-1)
   return is_inside
 
 
@@ -413,53 +437,42 @@ def BBoxCorners(bboxes):
   """Extract the corner points from a 7-DOF bbox representation.
 
   Args:
-    bboxes: A [batch, num_boxes, 7] floating point bounding box representation
-      ([x, y, z, dx, dy, dz, phi]).
+    bboxes: A [..., 7] floating point bounding box representation ([x, y, z,
+      dx, dy, dz, phi]), e.g. of shape [batch, num_boxes, 7].
 
   Returns:
-    A [batch, num_boxes, 8, 3] floating point Tensor containing
-      the corner (x, y, z) points for every bounding box.
+    A [..., 8, 3] floating point Tensor containing the corner (x, y, z) points
+    for every bounding box.
   """
   # Code adapted from vale/soapbox codebase.
   #
-  # Corners in normalized box frame (unit cube centered at origin).
-  #
   # Dimensions is [length, width, height].
-  corners = tf.constant([
-      [0.5, 0.5, 0.5],  # top
-      [-0.5, 0.5, 0.5],  # top
-      [-0.5, -0.5, 0.5],  # top
-      [0.5, -0.5, 0.5],  # top
-      [0.5, 0.5, -0.5],  # bottom
-      [-0.5, 0.5, -0.5],  # bottom
-      [-0.5, -0.5, -0.5],  # bottom
-      [0.5, -0.5, -0.5],  # bottom
-  ])
-
-  batch, nb, _ = py_utils.GetShape(bboxes, 3)
+  corners = tf.constant(_UNIT_CUBE_CORNERS, dtype=bboxes.dtype)
 
   # Extract location, dimension, and rotation.
-  location = bboxes[:, :, :3]
-  dimensions = bboxes[:, :, 3:6]
-  phi_world = bboxes[:, :, 6]
-
-  # Convert rotation_phis into rotation matrices along unit z.
-  cos = tf.cos(phi_world)
-  sin = tf.sin(phi_world)
-  zero = tf.zeros_like(cos)
-  one = tf.ones_like(cos)
-  rotations_world = tf.reshape(
-      tf.stack([cos, -sin, zero, sin, cos, zero, zero, zero, one], axis=2),
-      [batch, nb, 3, 3])
+  location = bboxes[..., :3]
+  dimensions = bboxes[..., 3:6]
+  phi_world = bboxes[..., 6]
 
   # Create axis-aligned corners from length/width/height.
-  corners = tf.einsum('bni,ji->bnji', dimensions, corners)
-
-  # Rotate the corners coordinates to the rotated world frame.
-  corners = tf.einsum('bnij,bnkj->bnki', rotations_world, corners)
+  corners = corners * tf.expand_dims(dimensions, -2)
+
+  # Rotate the corners coordinates to the rotated world frame. The rotation
+  # is about unit z, so only x and y change and it is applied directly
+  # rather than through a full 3x3 rotation matrix.
+  cos = tf.expand_dims(tf.cos(phi_world), -1)
+  sin = tf.expand_dims(tf.sin(phi_world), -1)
+  corners_x, corners_y, corners_z = tf.unstack(corners, num=3, axis=-1)
+  corners = tf.stack(
+      [
+          cos * corners_x - sin * corners_y,
+          sin * corners_x + cos * corners_y,
+          corners_z,
+      ],
+      axis=-1)
 
   # Translate corners to the world location.
-  corners = corners + tf.reshape(location, (batch, nb, 1, 3))
+  corners = corners + tf.expand_dims(location, -2)
   return corners
 
 
@@ -485,9 +498,8 @@ def IsWithinBBox3D(points_3d, bboxes_3d):
   num_bboxes, _ = py_utils.GetShape(bboxes_3d, 2)
 
   # Compute the 3-D corners of the bounding boxes.
-  bboxes_3d_b = tf.expand_dims(bboxes_3d, 0)
-  bbox_corners = BBoxCorners(bboxes_3d_b)
-  bbox_corners = py_utils.HasShape(bbox_corners, [1, -1, 8, 3])
+  bbox_corners = BBoxCorners(bboxes_3d)
+  bbox_corners = py_utils.HasShape(bbox_corners, [-1, 8, 3])
   # First four points are the top of the bounding box.
   # Counter-clockwise arrangement of points specifying 2-d Euclidean box.
   #   (x0, y1) <--- (x1, y1)
@@ -495,7 +507,7 @@ def IsWithinBBox3D(points_3d, bboxes_3d):
   #                    |
   #                    |
   #   (x0, y0) ---> (x1, y0)
-  bboxes_2d_corners = bbox_corners[0, :, 0:4, 0:2]
+  bboxes_2d_corners = bbox_corners[:, 0:4, 0:2]
   bboxes_2d_corners = py_utils.HasShape(bboxes_2d_corners, [-1, 4, 2])
   # Determine if points lie within 2-D (x, y) plane for all bounding boxes.
   points_2d = points_3d[:, :2]
@@ -510,15 +522,13 @@ def IsWithinBBox3D(points_3d, bboxes_3d):
     right = center + width / 2.0
     return left, right
 
-  z0, z1 = _ComputeLimits(z, dz)
-  z_points = tf.expand_dims(points_3d[:, 2], -1)
-
-  def _BroadcastAcrossPoints(z):
-    return tf.transpose(tf.tile(z, [1, num_points]))
+  # z0 and z1 are [num_bboxes, 1]; lay them out as [1, num_bboxes] so the
+  # comparisons below broadcast against the [num_points, 1] z_points.
+  z0, z1 = _ComputeLimits(tf.reshape(z, [1, -1]), tf.reshape(dz, [1, -1]))
+  z_points = points_3d[:, 2:3]
 
   is_inside_z = tf.logical_and(
-      tf.less_equal(z_points, _BroadcastAcrossPoints(z1)),
-      tf.greater_equal(z_points, _BroadcastAcrossPoints(z0)))
+      tf.less_equal(z_points, z1), tf.greater_equal(z_points, z0))
   is_inside_z = py_utils.HasShape(is_inside_z, [num_points, num_bboxes])
 
   return tf.logical_and(is_inside_z, is_inside_2d)
@@ -540,8 +550,9 @@ def SphericalCoordinatesTransform(points_xyz):
     azimuth/yaw (rotation around z), and theta corresponds to pitch/inclination
     (rotation around y).
   """
-  dist = tf.sqrt(tf.reduce_sum(tf.square(points_xyz), axis=-1))
-  theta = tf.acos(points_xyz[..., 2] / tf.maximum(dist, 1e-7))
+  x, y, z = tf.unstack(points_xyz, num=3, axis=-1)
+  dist = tf.sqrt(tf.square(x) + tf.square(y) + tf.square(z))
+  theta = tf.acos(z / tf.maximum(dist, 1e-7))
   # Note: tf.atan2 takes in (y, x).
-  phi = tf.atan2(points_xyz[..., 1], points_xyz[..., 0])
+  phi = tf.atan2(y, x)
   return tf.stack([dist, theta, phi], axis=-1)
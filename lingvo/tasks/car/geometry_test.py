@@ -98,6 +98,20 @@ class GeometryTest(test_utils.TestCase):
 
     self.assertEqual(indices.shape, (0,))
 
+  def testReorderIndicesByPhiDynamicShape(self):
+    anchor = tf.constant([1., 0.], tf.float32)
+    bboxes = tf.placeholder(tf.float32, [None, 4])
+    indices = geometry.ReorderIndicesByPhi(anchor, bboxes)
+    with self.session() as sess:
+      empty_indices = sess.run(indices, {bboxes: np.zeros([0, 4])})
+      self.assertEqual(empty_indices.shape, (0,))
+      # Centroids at (x, y) = (1, 1), (1, -1) and (-1, 1).
+      nonempty_indices = sess.run(
+          indices,
+          {bboxes: [[0.5, 0.5, 1.5, 1.5], [-1.5, 0.5, -0.5, 1.5],
+                    [0.5, -1.5, 1.5, -0.5]]})
+      self.assertAllEqual(nonempty_indices, [1, 2, 0])
+
   def testDistanceBetweenCentroidsAndBBoxesFastAndFurious(self):
     # pyformat: disabled
     predicted = np.array([
@@ -267,6 +281,21 @@ class GeometryTest(test_utils.TestCase):
       expected = [[False]] * 8 + [[True]] * 2
       self.assertAllEqual(expected, is_inside)
 
+  def testIsWithinBBoxFarFromOrigin(self):
+    # Points exactly on the edges of a box far from the origin must still be
+    # inside.
+    bbox = tf.constant([[[1e4, 1e4], [1e4 + 1., 1e4], [1e4 + 1., 1e4 + 1.],
+                         [1e4, 1e4 + 1.]]],
+                       dtype=tf.float32)
+    points = tf.constant(
+        [[1e4 + .5, 1e4 + .5], [1e4 + .5, 1e4], [1e4 + 1., 1e4 + .5],
+         [1e4 + 1., 1e4 + 1.], [1e4 + 1.5, 1e4 + .5], [1e4 - .5, 1e4 + .5]],
+        dtype=tf.float32)
+    with self.session() as sess:
+      is_inside = sess.run(geometry.IsWithinBBox(points, bbox))
+      expected = [[True]] * 4 + [[False]] * 2
+      self.assertAllEqual(expected, is_inside)
+
   def testIsWithinRotatedBBox(self):
     bbox = tf.constant([[[.2, 0.], [1., .2], [.8, 1.], [0., .8]]],
                        dtype=tf.float32)
@@ -324,6 +353,16 @@ class GeometryTest(test_utils.TestCase):
         self.assertAllClose(0, np.min(corners_np[1, i, :, 2]))
         self.assertAllClose(6, np.max(corners_np[1, i, :, 2]))
 
+  def testBBoxCornersUnbatched(self):
+    bboxes = np.array([[1, 2, 3, 4, 3, 6, 0.], [1, 2, 3, 4, 3, 6, np.pi / 2.]],
+                      dtype=np.float32)
+    corners = geometry.BBoxCorners(tf.constant(bboxes))
+    batched_corners = geometry.BBoxCorners(tf.constant(bboxes[np.newaxis]))
+    with self.session() as sess:
+      corners_np, batched_corners_np = sess.run([corners, batched_corners])
+      self.assertEqual((2, 8, 3), corners_np.shape)
+      self.assertAllClose(batched_corners_np[0], corners_np)
+
   def testSphericalCoordinatesTransform(self):
     np_xyz = np.random.randn(5, 6, 3)
     points_xyz = tf.constant(np_xyz, dtype=tf.float32)
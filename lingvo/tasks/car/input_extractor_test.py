@@ -18,13 +18,66 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+
+import os
+
 from lingvo import compat as tf
 from lingvo.core import hyperparams
+from lingvo.core import py_utils
 from lingvo.core import test_utils
 from lingvo.tasks.car import input_extractor
 from lingvo.tasks.car import input_preprocessors
 
 
+class _ToyExtractor(input_extractor.FieldsExtractor):
+  """Extracts 'x' and filters out examples whose first value is negative."""
+
+  def FeatureMap(self):
+    return {'x': tf.FixedLenFeature([2], tf.float32)}
+
+  def _Extract(self, features):
+    return py_utils.NestedMap(x=features['x'])
+
+  def Filter(self, outputs):
+    is_negative = tf.to_int32(tf.less(outputs.x[0], 0.))
+    return 1 + is_negative * input_extractor.BUCKET_UPPER_BOUND
+
+  def Shape(self):
+    return py_utils.NestedMap(x=tf.TensorShape([2]))
+
+  def DType(self):
+    return py_utils.NestedMap(x=tf.float32)
+
+
+class _DoubleX(input_preprocessors.Preprocessor):
+  """Doubles the output of _ToyExtractor."""
+
+  def TransformFeatures(self, features):
+    features.toy.x *= 2.
+    return features
+
+  def TransformShapes(self, shapes):
+    return shapes
+
+  def TransformDTypes(self, dtypes):
+    return dtypes
+
+
+def _ToyExtractorParams():
+  extractors = hyperparams.Params()
+  extractors.Define('toy', _ToyExtractor.Params(), '')
+  preprocessors = hyperparams.Params()
+  preprocessors.Define('double_x', _DoubleX.Params(), '')
+  return input_extractor.BaseExtractor.Params(extractors).Set(
+      preprocessors=preprocessors, preprocessors_order=['double_x'])
+
+
+def _ToyRecord(x):
+  feature = {'x': tf.train.Feature(float_list=tf.train.FloatList(value=x))}
+  example = tf.train.Example(features=tf.train.Features(feature=feature))
+  return example.SerializeToString()
+
+
 class InputExtractorTest(test_utils.TestCase):
 
   def testBaseExtractorRaisesErrorWithMissingPreprocessorKeys(self):
@@ -43,6 +96,64 @@ class InputExtractorTest(test_utils.TestCase):
         r'preprocessor_order specifies keys which were not found .*'):
       p.Instantiate()
 
+  def testBaseExtractorRaisesErrorWithInvalidRecordType(self):
+    p = input_extractor.BaseExtractor.Params(hyperparams.Params()).Set(
+        record_type='INVALID')
+    with self.assertRaisesRegexp(ValueError, r'Invalid record_type: INVALID'):
+      p.Instantiate()
+
+  def testExtractUsingExtractors(self):
+    with self.session(graph=tf.Graph()) as sess:
+      extractor = _ToyExtractorParams().Instantiate()
+      kept_bucket, kept = extractor.ExtractUsingExtractors(
+          tf.constant(_ToyRecord([1., 2.])))
+      dropped_bucket, dropped = extractor.ExtractUsingExtractors(
+          tf.constant(_ToyRecord([-1., 2.])))
+      # The outputs of the tf.cond() have no static shape; see NullLike.
+      self.assertFalse(kept.toy.x.shape.is_fully_defined())
+      (kept_bucket, kept, dropped_bucket, dropped) = sess.run(
+          [kept_bucket, kept, dropped_bucket, dropped])
+    self.assertEqual(1, kept_bucket)
+    self.assertAllClose([2., 4.], kept.toy.x)
+    self.assertGreaterEqual(dropped_bucket, input_extractor.BUCKET_UPPER_BOUND)
+    self.assertEqual((0,), dropped.toy.x.shape)
+
+  def testAlwaysRunPreprocessorsDropsFilteredRecords(self):
+    data_path = os.path.join(self.get_temp_dir(), 'toy.tfrecord')
+    with tf.io.TFRecordWriter(data_path) as w:
+      for x in [[1., 2.], [-1., 2.], [3., 4.], [-3., 4.]]:
+        w.write(_ToyRecord(x))
+
+    p = _ToyExtractorParams()
+    p.always_run_preprocessors = True
+    p.batch_size = 2
+    p.file_datasource.file_pattern = data_path
+    p.file_datasource.file_type = 'tfrecord'
+    p.require_sequential_order = True
+    with self.session(graph=tf.Graph()) as sess:
+      extractor = p.Instantiate()
+      dropped_bucket, dropped = extractor.ExtractUsingExtractors(
+          tf.constant(_ToyRecord([-1., 2.])))
+      batch = extractor.InputBatch()
+      dropped_bucket, dropped, batch = sess.run(
+          [dropped_bucket, dropped, batch])
+    # The preprocessors ran on the filtered record, but its bucket still makes
+    # generic_input drop it.
+    self.assertGreaterEqual(dropped_bucket, input_extractor.BUCKET_UPPER_BOUND)
+    self.assertAllClose([-2., 4.], dropped.toy.x)
+    self.assertAllClose([[2., 4.], [6., 8.]], batch.toy.x)
+
+  def testJitPreprocess(self):
+    p = _ToyExtractorParams()
+    p.jit_preprocess = True
+    with self.session(graph=tf.Graph()) as sess:
+      extractor = p.Instantiate()
+      bucket, extracted = extractor.ExtractUsingExtractors(
+          tf.constant(_ToyRecord([1., 2.])))
+      bucket, extracted = sess.run([bucket, extracted])
+    self.assertEqual(1, bucket)
+    self.assertAllClose([2., 4.], extracted.toy.x)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -42,12 +42,16 @@ def _ConsistentShuffle(tensors, seed):
 
 def _GetApplyPointMaskFn(points_mask):
   """Returns a function that applies a mask to one of our points tensors."""
+  # The returned function is applied to every points tensor, so the indices of
+  # the kept points are computed once and shared by all of them instead of
+  # compacting the mask again in each boolean_mask.
+  points_indices = tf.reshape(tf.where(points_mask), [-1])
 
   def _ApplyPointMaskFn(points_tensor):
     """Applies a mask to the points tensor."""
     if points_tensor is None:
       return points_tensor
-    return tf.boolean_mask(points_tensor, points_mask)
+    return tf.gather(points_tensor, points_indices)
 
   return _ApplyPointMaskFn
 
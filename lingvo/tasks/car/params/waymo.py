@@ -225,8 +225,12 @@ class StarNetBase(base_model_params.SingleTaskModelParams):
     p.file_buffer_size = 32
     p.file_parallelism = 8
     p.num_batcher_threads = 8
+    # Keep a couple of batches ready so the trainer does not stall on the
+    # input op while the next batch is being merged.
+    p.prefetch_buffer_size = 2
     if self.RUN_LOCALLY:
       p.num_batcher_threads = 1
+      p.prefetch_buffer_size = 1
       p.file_buffer_size = 1
       p.file_parallelism = 1
 
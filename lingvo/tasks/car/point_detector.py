@@ -121,6 +121,52 @@ class PointDetectorBase(base_model.BaseTask):
     result = inputs.DType().Pack(placeholders)
     return result
 
+  def _DecodeWithNMS(self,
+                     predicted_bboxes,
+                     classification_logits,
+                     nms_on_cpu=False):
+    """Computes the classification scores and performs NMS.
+
+    Args:
+      predicted_bboxes: A [batch_size, num_boxes, 7] floating point Tensor.
+      classification_logits: A [batch_size, num_boxes, num_classes] floating
+        point Tensor.
+      nms_on_cpu: If True, NMS itself is placed on the CPU. The elementwise ops
+        around it are left to the default placement.
+
+    Returns:
+      A tuple (per_cls_bboxes, per_cls_bbox_scores, per_cls_valid_mask) as
+      returned by detection_decoder.DecodeWithNMS, with the scores of the boxes
+      not selected by NMS set to 0.
+    """
+    p = self.params
+    classification_scores = tf.sigmoid(classification_logits)
+
+    def _NMS():
+      return detection_decoder.DecodeWithNMS(
+          predicted_bboxes,
+          classification_scores,
+          nms_iou_threshold=p.nms_iou_threshold,
+          score_threshold=p.nms_score_threshold,
+          max_boxes_per_class=p.max_nms_boxes,
+          use_oriented_per_class_nms=p.use_oriented_per_class_nms)
+
+    if nms_on_cpu:
+      with tf.device('/cpu:0'):
+        per_cls_bboxes, per_cls_bbox_scores, per_cls_valid_mask = _NMS()
+    else:
+      per_cls_bboxes, per_cls_bbox_scores, per_cls_valid_mask = _NMS()
+
+    # per_cls_valid_mask is [batch, num_classes, num_boxes] Tensor that
+    # indicates which boxes were selected by NMS. Each example will have a
+    # different number of chosen bboxes, so the mask is present to allow us
+    # to keep the boxes as a batched dense Tensor.
+    #
+    # We mask the scores by the per_cls_valid_mask so that none of these boxes
+    # will be interpreted as valid.
+    per_cls_bbox_scores *= per_cls_valid_mask
+    return per_cls_bboxes, per_cls_bbox_scores, per_cls_valid_mask
+
   def Inference(self):
     """Builds the inference graph.
 
@@ -134,24 +180,15 @@ class PointDetectorBase(base_model.BaseTask):
     Returns:
       A dictionary whose values are a tuple of fetches and feeds.
     """
-    p = self.params
     subgraphs = {}
     with tf.name_scope('inference'):
       input_placeholders = self._Placeholders()
       bboxes_and_logits = self._BBoxesAndLogits(input_placeholders)
       predicted_bboxes = bboxes_and_logits.predicted_bboxes
       classification_logits = bboxes_and_logits.classification_logits
-      classification_scores = tf.sigmoid(classification_logits)
 
       per_cls_bboxes, per_cls_bbox_scores, per_cls_valid_mask = (
-          detection_decoder.DecodeWithNMS(
-              predicted_bboxes,
-              classification_scores,
-              nms_iou_threshold=p.nms_iou_threshold,
-              score_threshold=p.nms_score_threshold,
-              max_boxes_per_class=p.max_nms_boxes,
-              use_oriented_per_class_nms=p.use_oriented_per_class_nms))
-      per_cls_bbox_scores *= per_cls_valid_mask
+          self._DecodeWithNMS(predicted_bboxes, classification_logits))
 
       # TODO(vrv): Fix the inference graph for KITTI, since we need
       # to apply frustum clipping.  This requires customizing the
@@ -176,36 +213,21 @@ class PointDetectorBase(base_model.BaseTask):
     classification_logits = py_utils.HasShape(
         classification_logits, [batch_size, num_bboxes, p.num_classes])
 
-    classification_scores = tf.sigmoid(classification_logits)
-
-    with tf.device('/cpu:0'):
-      # Decode the predicted bboxes, performing NMS.
-      per_cls_bboxes, per_cls_bbox_scores, per_cls_valid_mask = (
-          detection_decoder.DecodeWithNMS(
-              predicted_bboxes,
-              classification_scores,
-              nms_iou_threshold=p.nms_iou_threshold,
-              score_threshold=p.nms_score_threshold,
-              max_boxes_per_class=p.max_nms_boxes,
-              use_oriented_per_class_nms=p.use_oriented_per_class_nms))
-
-      # per_cls_valid_mask is [batch, num_classes, num_boxes] Tensor that
-      # indicates which boxes were selected by NMS. Each example will have a
-      # different number of chosen bboxes, so the mask is present to allow us
-      # to keep the boxes as a batched dense Tensor.
-      #
-      # We mask the scores by the per_cls_valid_mask so that none of these boxes
-      # will be interpreted as valid.
-      per_cls_bbox_scores *= per_cls_valid_mask
-      visualization_weights = py_utils.HasShape(
-          per_cls_bbox_scores, [batch_size, p.num_classes, p.max_nms_boxes])
-
-      # For top down visualization, filter boxes whose scores are not above the
-      # visualization threshold.
-      visualization_weights = tf.where(
-          tf.greater_equal(visualization_weights,
-                           p.visualization_classification_threshold),
-          visualization_weights, tf.zeros_like(visualization_weights))
+    # Decode the predicted bboxes, performing NMS. Only NMS runs on the CPU;
+    # the elementwise ops before and after it stay with the rest of the model.
+    per_cls_bboxes, per_cls_bbox_scores, per_cls_valid_mask = (
+        self._DecodeWithNMS(
+            predicted_bboxes, classification_logits, nms_on_cpu=True))
+
+    visualization_weights = py_utils.HasShape(
+        per_cls_bbox_scores, [batch_size, p.num_classes, p.max_nms_boxes])
+
+    # For top down visualization, filter boxes whose scores are not above the
+    # visualization threshold.
+    visualization_weights *= tf.cast(
+        tf.greater_equal(visualization_weights,
+                         p.visualization_classification_threshold),
+        visualization_weights.dtype)
 
     model_outputs = py_utils.NestedMap()
     model_outputs.per_class_predicted_bboxes = per_cls_bboxes
@@ -18,41 +18,70 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+
+from absl.testing import parameterized
 from lingvo import compat as tf
 from lingvo.core import py_utils
 from lingvo.core import test_utils
 from lingvo.tasks.car import pointnet
+import numpy as np
 
 
-class PointNetTest(test_utils.TestCase):
+class PointNetTest(test_utils.TestCase, parameterized.TestCase):
 
-  def _testOutShape(self, p, input_shape, expected_shape):
-    batch_size, num_points, _ = input_shape
+  def _testOutShapes(self, cases):
+    """Checks the output shapes of networks built and run in a single graph.
+
+    Sharing one graph and session lets a test check several configurations with
+    a single variable initialization and a single run.
+
+    Args:
+      cases: A list of (params, input_shape, expected_shape) tuples. The params
+        must have distinct names.
+    """
+    # The tests only check output shapes, so features and labels are zeros.
+    # Points are generated with numpy and embedded in the graph as constants,
+    # so that the sampling and grouping in PointNet++ see distinct points.
+    rng = np.random.RandomState(12345)
     g = tf.Graph()
-    with g.as_default():
-      net = p.Instantiate()
-      input_data = py_utils.NestedMap(
-          points=tf.random_uniform((batch_size, num_points, 3)),
-          features=tf.random_uniform(input_shape),
-          padding=tf.zeros((batch_size, num_points), dtype=tf.float32),
-          label=tf.random_uniform((batch_size,),
-                                  minval=0,
-                                  maxval=16,
-                                  dtype=tf.int32))
-      result = net.FPropDefaultTheta(input_data)
-    with self.session(graph=g) as sess:
+    results = []
+    # The test inputs are tiny, so GPU kernel launches would cost more than the
+    # compute. The ops are built under a CPU device scope because the session
+    # only pins ops created inside its own context.
+    with g.as_default(), tf.device('/cpu:0'):
+      for p, input_shape, _ in cases:
+        batch_size, num_points, input_dims = input_shape
+        net = p.Instantiate()
+        input_data = py_utils.NestedMap(
+            points=tf.constant(
+                rng.uniform(size=(batch_size, num_points, 3)), tf.float32),
+            features=tf.zeros((batch_size, num_points, input_dims),
+                              dtype=tf.float32),
+            padding=tf.zeros((batch_size, num_points), dtype=tf.float32),
+            label=tf.zeros((batch_size,), dtype=tf.int32))
+        results.append(net.FPropDefaultTheta(input_data))
+    with self.session(graph=g, use_gpu=False) as sess:
       sess.run(tf.global_variables_initializer())
-      np_result = sess.run(result)
-    self.assertEqual(np_result.shape, expected_shape)
+      np_results = sess.run(results)
+    for (_, _, expected_shape), np_result in zip(cases, np_results):
+      self.assertEqual(np_result.shape, expected_shape)
 
-  def testPointNetClassifier(self):
-    for feature_dims in [128, 256]:
-      for input_dims in [3, 6, 9]:
-        p = pointnet.PointNet().Classifier(
-            input_dims=input_dims, feature_dims=feature_dims)
-        # Network should produce a global feature of feature_dims.
-        self.assertEqual(p.output_dim, feature_dims)
-        self._testOutShape(p, (8, 128, input_dims), (8, feature_dims))
+  def _testOutShape(self, p, input_shape, expected_shape):
+    self._testOutShapes([(p, input_shape, expected_shape)])
+
+  @parameterized.parameters(128, 256)
+  def testPointNetClassifier(self, feature_dims):
+    builder = pointnet.PointNet()
+    cases = []
+    for input_dims in [3, 6, 9]:
+      p = builder.Classifier(
+          name='pointnet_%d' % input_dims,
+          input_dims=input_dims,
+          feature_dims=feature_dims)
+      # Network should produce a global feature of feature_dims.
+      self.assertEqual(p.output_dim, feature_dims)
+      cases.append((p, (8, 128, input_dims), (8, feature_dims)))
+    self._testOutShapes(cases)
 
   def testPointNetSegmentation(self):
     p = pointnet.PointNet().Segmentation()
@@ -63,16 +92,23 @@ class PointNetTest(test_utils.TestCase):
   def testPointNetSegmentationShapeNet(self):
     p = pointnet.PointNet().SegmentationShapeNet()
     self.assertEqual(p.output_dim, 128)
-    self._testOutShape(p, (8, 2000, 3), (8, 2000, 128))
+    # The network has no sampling or grouping that depends on the number of
+    # points, so a small point cloud exercises the same graph as a full scan.
+    self._testOutShape(p, (8, 100, 3), (8, 100, 128))
 
-  def testPointNetPPClassifier(self):
-    for feature_dims in [128, 256]:
-      for input_dims in [3, 6, 9]:
-        p = pointnet.PointNetPP().Classifier(
-            input_dims=input_dims, feature_dims=feature_dims)
-        # Network should produce a global feature of feature_dims.
-        self.assertEqual(p.output_dim, feature_dims)
-        self._testOutShape(p, (8, 1024, input_dims), (8, feature_dims))
+  @parameterized.parameters(128, 256)
+  def testPointNetPPClassifier(self, feature_dims):
+    builder = pointnet.PointNetPP()
+    cases = []
+    for input_dims in [3, 6, 9]:
+      p = builder.Classifier(
+          name='pointnetpp_%d' % input_dims,
+          input_dims=input_dims,
+          feature_dims=feature_dims)
+      # Network should produce a global feature of feature_dims.
+      self.assertEqual(p.output_dim, feature_dims)
+      cases.append((p, (8, 1024, input_dims), (8, feature_dims)))
+    self._testOutShapes(cases)
 
 
 if __name__ == '__main__':
@@ -30,11 +30,32 @@ import numpy as np
 
 
 def _Dense(sparse, default_value=0):
+  # The indices of a parsed VarLenFeature are sorted and unique, so they need
+  # no validation.
   return tf.sparse_to_dense(
       sparse_indices=sparse.indices,
       output_shape=sparse.dense_shape,
       sparse_values=sparse.values,
-      default_value=default_value)
+      default_value=default_value,
+      validate_indices=False)
+
+
+def _AzimuthSinCosTable(width):
+  """Returns the cos and sin of the uncorrected azimuth of each column.
+
+  The azimuth of column i of a range image of the given width, before the
+  extrinsics correction, only depends on the width, so it is computed with
+  numpy when the graph is built.
+
+  Args:
+    width: A python int, the width of the range image.
+
+  Returns:
+    A tuple of two [width] float32 numpy arrays (cos, sin).
+  """
+  ratios = (np.arange(width, 0, -1, dtype=np.float64) - .5) / width
+  azimuth = (ratios * 2. - 1.) * np.pi
+  return np.cos(azimuth).astype(np.float32), np.sin(azimuth).astype(np.float32)
 
 
 def _NestedMapToParams(nmap):
@@ -125,7 +146,7 @@ class WaymoFrameMetadataExtractor(input_extractor.FieldsExtractor):
   def FeatureMap(self):
     """Return a dictionary from tf.Example feature names to Features."""
     feature_map = {}
-    feature_map['pose'] = tf.VarLenFeature(dtype=tf.float32)
+    feature_map['pose'] = tf.FixedLenFeature([16], tf.float32)
     feature_map['run_segment'] = tf.FixedLenFeature((), tf.string, '')
     feature_map['run_start_offset'] = tf.FixedLenFeature((), tf.int64, 0)
     feature_map['time_of_day'] = tf.FixedLenFeature((), tf.string, '')
@@ -135,7 +156,7 @@ class WaymoFrameMetadataExtractor(input_extractor.FieldsExtractor):
 
   def _Extract(self, features):
     """Extract data into Tensor format."""
-    vehicle_pose = tf.reshape(_Dense(features['pose']), [4, 4])
+    vehicle_pose = tf.reshape(features['pose'], [4, 4])
     run_segment = features['run_segment']
     run_start_offset = features['run_start_offset']
     time_of_day = features['time_of_day']
@@ -192,8 +213,11 @@ class WaymoImageExtractor(input_extractor.FieldsExtractor):
   """Extracts the camera image data from a WaymoOD tf.Example.
 
    Emits:
-    images: [height, width, 3] - Images from the corresponding cameras.
+    images: [height, width, 3] - uint8 images from the corresponding cameras.
     The cameras are [FRONT, FRONT_LEFT, FRONT_RIGHT, SIDE_LEFT, SIDE_RIGHT].
+    Images are kept as uint8 through the input pipeline so that the batches
+    are a quarter of the size of float32 ones; consumers should cast them
+    where they are used.
 
     intrinsics: [9] - Instrinsics of the camera.
 
@@ -221,24 +245,24 @@ class WaymoImageExtractor(input_extractor.FieldsExtractor):
     """Return a dictionary from tf.Example feature names to Features."""
     p = self.params
     features = {}
-    features['pose'] = tf.VarLenFeature(dtype=tf.float32)
+    features['pose'] = tf.FixedLenFeature([16], tf.float32)
 
     for camera_name in p.camera_names:
       features['image_%s' % camera_name] = tf.VarLenFeature(dtype=tf.string)
       features['image_%s_shape' % camera_name] = (
           tf.VarLenFeature(dtype=tf.int64))
       features['camera_%s_intrinsics' %
-               camera_name] = tf.VarLenFeature(dtype=tf.float32)
+               camera_name] = tf.FixedLenFeature([9], tf.float32)
       features['camera_%s_extrinsics' %
-               camera_name] = tf.VarLenFeature(dtype=tf.float32)
+               camera_name] = tf.FixedLenFeature([16], tf.float32)
 
       features['camera_%s_rolling_shutter_direction' %
                camera_name] = tf.FixedLenFeature(
                    dtype=tf.int64, shape=())
       features['image_%s_pose' %
-               camera_name] = tf.VarLenFeature(dtype=tf.float32)
+               camera_name] = tf.FixedLenFeature([16], tf.float32)
       features['image_%s_velocity' %
-               camera_name] = tf.VarLenFeature(dtype=tf.float32)
+               camera_name] = tf.FixedLenFeature([6], tf.float32)
 
       for feat in [
           'pose_timestamp', 'shutter', 'camera_trigger_time',
@@ -253,23 +277,25 @@ class WaymoImageExtractor(input_extractor.FieldsExtractor):
     outputs = {}
     p = self.params
 
-    outputs['frame_pose'] = tf.reshape(_Dense(features['pose']), [4, 4])
+    outputs['frame_pose'] = tf.reshape(features['pose'], [4, 4])
 
     for camera_name in p.camera_names:
       image_shape = tf.reshape(
           _Dense(features['image_%s_shape' % camera_name]), [-1])
+      # The cameras are decoded by independent ops, which the executor
+      # schedules concurrently. Fixing the channel count gives the decoded
+      # image a static last dimension.
       image = tf.io.decode_png(
           tf.strings.reduce_join(
-              _Dense(features['image_%s' % camera_name], default_value='')))
+              _Dense(features['image_%s' % camera_name], default_value='')),
+          channels=p.image_shape[-1])
       image = tf.reshape(image, image_shape)
       image = py_utils.PadOrTrimTo(image, p.image_shape)
-      intrinsics = tf.reshape(
-          _Dense(features['camera_%s_intrinsics' % camera_name]), [9])
+      intrinsics = features['camera_%s_intrinsics' % camera_name]
       extrinsics = tf.reshape(
-          _Dense(features['camera_%s_extrinsics' % camera_name]), [4, 4])
-      pose = tf.reshape(_Dense(features['image_%s_pose' % camera_name]), [4, 4])
-      velocity = tf.reshape(
-          _Dense(features['image_%s_velocity' % camera_name]), [6])
+          features['camera_%s_extrinsics' % camera_name], [4, 4])
+      pose = tf.reshape(features['image_%s_pose' % camera_name], [4, 4])
+      velocity = features['image_%s_velocity' % camera_name]
       outputs['%s' % camera_name] = image
       outputs['%s_intrinsics' % camera_name] = intrinsics
       outputs['%s_extrinsics' % camera_name] = extrinsics
@@ -359,23 +385,20 @@ class WaymoLaserExtractor(input_extractor.LaserExtractor):
   def _Extract(self, features):
     """Returns the laser Tensor."""
     p = self.params
-    all_xyzs = []
-    all_laser_features = []
-
+    # The values of a rank 1 VarLenFeature are already its dense contents in
+    # order, so the flat laser data of every lidar and return is concatenated
+    # directly and split into xyz and features once.
+    all_laser_data = []
     for lidar in p.lidar_names:
       for ri in ['ri1', 'ri2']:
         feature_name = 'laser_%s_%s' % (lidar, ri)
-        laser_data = tf.reshape(
-            _Dense(features[feature_name]), [-1, 3 + p.num_features])
-        points_xyz = laser_data[..., 0:3]
-        points_feature = laser_data[..., 3:]
-
-        all_xyzs += [points_xyz]
-        all_laser_features += [points_feature]
+        all_laser_data += [features[feature_name].values]
 
     # Stack all of the points along the major dimension
-    points_xyz = tf.concat(all_xyzs, axis=0)
-    points_feature = tf.concat(all_laser_features, axis=0)
+    laser_data = tf.reshape(
+        tf.concat(all_laser_data, axis=0), [-1, 3 + p.num_features])
+    points_xyz = laser_data[..., 0:3]
+    points_feature = laser_data[..., 3:]
 
     if p.max_num_points is not None:
       npoints = tf.shape(points_xyz)[0]
@@ -455,15 +478,18 @@ class WaymoLabelExtractor(input_extractor.FieldsExtractor):
     p = self.params
     # Label values match the proto enum car.open_dataset.Label.Type. The value
     # range is [1..4] for non-background labels.
+    #
+    # Every field is padded or trimmed on its own: records may not populate
+    # all of the per-object fields (e.g. label_metadata or the difficulties).
     labels = tf.to_int32(_Dense(features['labels']))
     labels = py_utils.PadOrTrimTo(labels, [p.max_num_objects])
     label_ids = tf.reshape(_Dense(features['label_ids'], ''), [-1])
     label_ids = py_utils.PadOrTrimTo(label_ids, [p.max_num_objects], '')
     bboxes_3d = tf.reshape(_Dense(features['bboxes_3d']), [-1, 7])
-    bboxes_3d_mask = tf.ones([tf.shape(bboxes_3d)[0]])
+    bboxes_3d_mask = tf.sequence_mask(
+        tf.shape(bboxes_3d)[0], p.max_num_objects, dtype=tf.float32)
     bboxes_3d_num_points = tf.to_int32(_Dense(features['bboxes_3d_num_points']))
     bboxes_3d = py_utils.PadOrTrimTo(bboxes_3d, [p.max_num_objects, 7])
-    bboxes_3d_mask = py_utils.PadOrTrimTo(bboxes_3d_mask, [p.max_num_objects])
     bboxes_3d_num_points = py_utils.PadOrTrimTo(bboxes_3d_num_points,
                                                 [p.max_num_objects])
     label_metadata = tf.reshape(_Dense(features['label_metadata']), [-1, 4])
@@ -561,7 +587,7 @@ class RangeImageExtractor(input_extractor.FieldsExtractor):
           .features: tf.float32 of ri_shape + [4]
           .mask: tf.float32 of ri_shape
 
-      $LASERNAME_beam_inclinations: tf.float32 [64] listing the
+      $LASERNAME_beam_inclinations: tf.float32 [gbr_ri_shape[0]] listing the
       non-uniform beam inclinations for the longer range laser.
 
       $LASERNAME_extrinsics: tf.float32 [4, 4] extrinsics matrix
@@ -607,36 +633,49 @@ class RangeImageExtractor(input_extractor.FieldsExtractor):
         'The names of the laser returns to export.  E.g., ri1 is '
         'the first return, ri2 is the second return.')
     p.Define('gbr_ri_shape', [64, 2650, 4], 'Shape of each GBR range image.')
+    p.Define(
+        'jit_xyz', False,
+        'If True, the xyz of each range image is computed with XLA, so that '
+        'masking the range and applying the rays fuse into one pass.')
     return p
 
   def FeatureMap(self):
     """Return a dictionary from tf.Example feature names to Features."""
     p = self.params
     feature_map = {}
+    # Fields with a known length are parsed as FixedLenFeatures so that they
+    # come out of parsing dense and need no sparse_to_dense.
     for laser in p.cbr_laser_names + p.gbr_laser_names:
-      feature_map['%s_beam_inclinations' % laser] = (
-          tf.VarLenFeature(dtype=tf.float32))
+      if laser in p.gbr_laser_names:
+        feature_map['%s_beam_inclinations' % laser] = (
+            tf.FixedLenFeature([p.gbr_ri_shape[0]], tf.float32))
+      else:
+        feature_map['%s_beam_inclinations' % laser] = (
+            tf.VarLenFeature(dtype=tf.float32))
       feature_map['%s_beam_inclination_min' % laser] = (
           tf.VarLenFeature(dtype=tf.float32))
       feature_map['%s_beam_inclination_max' % laser] = (
           tf.VarLenFeature(dtype=tf.float32))
-      feature_map['%s_extrinsics' % laser] = tf.VarLenFeature(dtype=tf.float32)
+      feature_map['%s_extrinsics' % laser] = tf.FixedLenFeature([16],
+                                                                tf.float32)
       if laser in p.gbr_laser_names:
-        feature_map['%s_pose' % laser] = tf.VarLenFeature(dtype=tf.float32)
+        # Per pixel [4, 4] pose.
+        feature_map['%s_pose' % laser] = tf.FixedLenFeature(
+            [p.gbr_ri_shape[0] * p.gbr_ri_shape[1] * 16], tf.float32)
 
       for returns in p.returns:
         feature_map['%s_%s' %
                     (laser, returns)] = tf.VarLenFeature(dtype=tf.float32)
         feature_map['%s_%s_shape' %
                     (laser, returns)] = tf.VarLenFeature(dtype=tf.int64)
-    feature_map['pose'] = tf.VarLenFeature(dtype=tf.float32)
+    feature_map['pose'] = tf.FixedLenFeature([16], tf.float32)
     return feature_map
 
   def _Extract(self, features):
     p = self.params
     ri_outputs = {}
     outputs = {}
-    frame_pose = tf.reshape(_Dense(features['pose']), [4, 4])
+    frame_pose = tf.reshape(features['pose'], [4, 4])
     for laser in p.cbr_laser_names + p.gbr_laser_names:
       # Extract range images.
       for returns in p.returns:
@@ -648,12 +687,14 @@ class RangeImageExtractor(input_extractor.FieldsExtractor):
         shape_to_check = (
             p.cbr_ri_shape if laser in p.cbr_laser_names else p.gbr_ri_shape)
         range_image = py_utils.HasShape(range_image, shape_to_check)
+        # The reshape above is to a dynamic shape; record the checked one.
+        range_image.set_shape(shape_to_check)
 
         ri_outputs['%s_%s' % (laser, returns)] = range_image
 
       # Extract beam inclinations and extrinsics
       outputs['%s_extrinsics' % laser] = tf.reshape(
-          _Dense(features['%s_extrinsics' % laser]), [4, 4])
+          features['%s_extrinsics' % laser], [4, 4])
 
     # CBRs have uniform inclination
     for laser in p.cbr_laser_names:
@@ -664,10 +705,10 @@ class RangeImageExtractor(input_extractor.FieldsExtractor):
       outputs['%s_beam_inclinations' % laser] = tf.stack(
           [beam_inclination_min, beam_inclination_max], axis=0)
 
-    # GBRs have non-uniform inclinations defined by 64 floats.
+    # GBRs have non-uniform inclinations, one per range image row.
     for laser in p.gbr_laser_names:
-      outputs['%s_beam_inclinations' % laser] = tf.reshape(
-          _Dense(features['%s_beam_inclinations' % laser]), [64])
+      outputs['%s_beam_inclinations' % laser] = (
+          features['%s_beam_inclinations' % laser])
 
     # Embed xyz onto each range image pixel.
     for laser in p.cbr_laser_names + p.gbr_laser_names:
@@ -685,25 +726,37 @@ class RangeImageExtractor(input_extractor.FieldsExtractor):
         min_inclination = inclinations[0]
         max_inclination = inclinations[1]
         diff = max_inclination - min_inclination
-        ratio = (.5 + tf.to_float(tf.range(0, height))) / tf.to_float(height)
-        # interpolate from min to max inclination.
+        # The first row of the range image has the highest inclination, so
+        # the ratios run from 1 down to 0.
+        ratio = tf.constant(
+            (.5 + np.arange(height - 1, -1, -1, dtype=np.float32)) / height)
+        # interpolate from max to min inclination.
         inclinations = (ratio * diff) + min_inclination
       else:
         ri_shape = p.gbr_ri_shape
+        # The beam inclinations are in ascending order, while the first row of
+        # the range image has the highest inclination.
+        inclinations = tf.reverse(inclinations, axis=[-1])
 
       pixel_pose = None
       if laser in p.gbr_laser_names:
         pixel_pose = tf.reshape(
-            _Dense(features['%s_pose' % laser]),
-            shape=p.gbr_ri_shape[0:2] + [4, 4])
+            features['%s_pose' % laser], shape=p.gbr_ri_shape[0:2] + [4, 4])
+
+      # The rays only depend on the laser, not on the return.
+      rays = self._RangeImageRays(ri_shape[0], ri_shape[1], extrinsics,
+                                  inclinations, pixel_pose, frame_pose)
 
       for returns in p.returns:
         range_image = ri_outputs['%s_%s' % (laser, returns)]
-        range_image = tf.reshape(range_image, ri_shape)
         range_image_mask = range_image[..., 0] >= 0
-        ri_xyz = tf.to_float(
-            self._XYZFromRangeImage(range_image, range_image_mask, extrinsics,
-                                    inclinations, pixel_pose, frame_pose))
+        if p.jit_xyz:
+          with tf.xla.experimental.jit_scope():
+            ri_xyz = self._XYZFromRangeImage(range_image, range_image_mask,
+                                             rays)
+        else:
+          ri_xyz = self._XYZFromRangeImage(range_image, range_image_mask, rays)
+        ri_xyz = tf.to_float(ri_xyz)
 
         # Produce the NestedMap of xyz, features, mask.
         ri_result = py_utils.NestedMap({
@@ -716,131 +769,152 @@ class RangeImageExtractor(input_extractor.FieldsExtractor):
 
     return py_utils.NestedMap(outputs)
 
-  def _XYZFromRangeImage(self,
-                         lidar_image,
-                         lidar_image_mask,
-                         extrinsics,
-                         inclinations,
-                         pixel_pose=None,
-                         frame_pose=None):
-    """Extract the cartesian coordinates from the range image.
+  def _RangeImageRays(self,
+                      height,
+                      width,
+                      extrinsics,
+                      inclinations,
+                      pixel_pose=None,
+                      frame_pose=None):
+    """Computes the ray of each pixel of a laser's range images.
+
+    The cartesian coordinates of a range image pixel are affine in its range,
+    origins + range * directions, where neither term depends on the range
+    image itself. They are computed once per laser and shared by all of its
+    returns.
 
     Args:
-       lidar_image: [H, W, C] range image Tensor.
-       lidar_image_mask: [H, W] boolean indicating which 2d coordinates in the
-         lidar image are present.
+       height: The height H of the range images, a python int.
+       width: The width W of the range images, a python int.
        extrinsics: [4, 4] float matrix representing transformation matrix to
          world coordinates.
-       inclinations: [V] beam inclinations vector.
+       inclinations: [H] beam inclination of each row of the range image, in
+         descending order.
        pixel_pose: [64, 2650, 4, 4] tensor representing per pixel pose of GBR.
        frame_pose: [4, 4] matrix representing vehicle to world transformation.
 
     Returns:
-      [H, W, 3] range image cartesian coordinates.
+      A tuple (directions, origins) of [H, W, 3] ray directions and ray origins
+      broadcastable to [H, W, 3].
     """
-    height, width, channels = py_utils.GetShape(lidar_image, 3)
-
     conversion_dtype = tf.float32
-    lidar_image = tf.cast(lidar_image, conversion_dtype)
     extrinsics = tf.cast(extrinsics, conversion_dtype)
     inclinations = tf.cast(inclinations, conversion_dtype)
-    inclinations = tf.reverse(inclinations, axis=[-1])
 
+    # The azimuth of each column is its uncorrected azimuth minus the
+    # az_correction given by the extrinsics. The sin and cos of the former are
+    # static tables, so only the sin and cos of the scalar correction are
+    # computed here, and combined with the angle difference identities.
     az_correction = py_utils.HasShape(
         tf.atan2(extrinsics[1, 0], extrinsics[0, 0]), [])
-    ratios = (tf.cast(tf.range(width, 0, -1), dtype=conversion_dtype) -
-              .5) / tf.cast(width, conversion_dtype)
-    ratios = py_utils.HasShape(ratios, [width])
-
-    azimuth = (ratios * 2. - 1.) * np.pi - az_correction[..., tf.newaxis]
-    azimuth = py_utils.HasShape(azimuth, [width])
+    cos_correction = tf.cos(az_correction)
+    sin_correction = tf.sin(az_correction)
+    cos_base, sin_base = _AzimuthSinCosTable(width)
+    cos_base = tf.constant(cos_base[np.newaxis, :], dtype=conversion_dtype)
+    sin_base = tf.constant(sin_base[np.newaxis, :], dtype=conversion_dtype)
 
-    lidar_image_mask = lidar_image_mask[..., tf.newaxis]
-    lidar_image_mask = tf.tile(lidar_image_mask, [1, 1, channels])
-    lidar_image = tf.where(lidar_image_mask, lidar_image,
-                           tf.zeros_like(lidar_image))
-    lidar_image_range = lidar_image[..., 0]
-
-    azimuth = py_utils.HasShape(azimuth[tf.newaxis, ...], [1, width])
     inclinations = py_utils.HasShape(inclinations[..., tf.newaxis], [height, 1])
 
-    cos_azimuth = tf.cos(azimuth)
-    sin_azimuth = tf.sin(azimuth)
+    # [1, W]
+    cos_azimuth = cos_base * cos_correction + sin_base * sin_correction
+    sin_azimuth = sin_base * cos_correction - cos_base * sin_correction
     cos_incl = tf.cos(inclinations)
     sin_incl = tf.sin(inclinations)
 
-    x = cos_azimuth * cos_incl * lidar_image_range
-    y = sin_azimuth * cos_incl * lidar_image_range
-    z = sin_incl * lidar_image_range
-
-    lidar_image_points = tf.stack([x, y, z], -1)
-    lidar_image_points = py_utils.HasShape(lidar_image_points,
-                                           [height, width, 3])
     rotation = extrinsics[0:3, 0:3]
-    translation = extrinsics[0:3, 3][tf.newaxis, ...]
+    translation = extrinsics[0:3, 3]
 
     # Transform the image points in cartesian coordinates to
     # the world coordinate system using the extrinsics matrix.
     #
-    # We first flatten the points, apply rotation, then
-    # reshape to restore the original input and then apply
-    # translation.
-    lidar_image_points = tf.matmul(
-        tf.reshape(lidar_image_points, [-1, 3]), rotation, transpose_b=True)
-    lidar_image_points = tf.reshape(lidar_image_points, [height, width, 3])
-    lidar_image_points += translation
-
-    lidar_image_points = py_utils.HasShape(lidar_image_points,
-                                           [height, width, 3])
+    # The unit direction of pixel (h, w) is
+    #   [cos_az[w] * cos_incl[h], sin_az[w] * cos_incl[h], sin_incl[h]],
+    # so its rotation is
+    #   cos_incl[h] * col_dirs[w] + sin_incl[h] * rotation[:, 2]
+    # with
+    #   col_dirs[w] = cos_az[w] * rotation[:, 0] + sin_az[w] * rotation[:, 1].
+    # Rotating the [W, 3] column directions instead of the [H * W, 3] points
+    # avoids materializing x, y, z and the unrotated points.
+    # [W, 3]
+    col_dirs = (
+        tf.transpose(cos_azimuth) * rotation[:, 0] +
+        tf.transpose(sin_azimuth) * rotation[:, 1])
+    # [H, W, 3]
+    directions = (
+        cos_incl[..., tf.newaxis] * col_dirs +
+        sin_incl[..., tf.newaxis] * rotation[:, 2])
+    directions = py_utils.HasShape(directions, [height, width, 3])
+    # [3]
+    origins = translation
+
     # GBR uses per pixel pose.
     if pixel_pose is not None:
       pixel_pose_rotation = pixel_pose[..., 0:3, 0:3]
       pixel_pose_translation = pixel_pose[..., 0:3, 3]
-      lidar_image_points = tf.einsum(
-          'hwij,hwj->hwi', pixel_pose_rotation,
-          lidar_image_points) + pixel_pose_translation
+      directions = tf.einsum('hwij,hwj->hwi', pixel_pose_rotation, directions)
+      # [H, W, 3]
+      origins = tf.einsum('hwij,j->hwi', pixel_pose_rotation,
+                          origins) + pixel_pose_translation
       if frame_pose is None:
         raise ValueError('frame_pose must be set when pixel_pose is set.')
-      # To vehicle frame corresponding to the given frame_pose
-      # [4, 4]
-      world_to_vehicle = tf.matrix_inverse(frame_pose)
-      world_to_vehicle_rotation = world_to_vehicle[0:3, 0:3]
-      world_to_vehicle_translation = world_to_vehicle[0:3, 3]
+      # To vehicle frame corresponding to the given frame_pose.
+      # frame_pose is a rigid transform [[R, t], [0, 1]], so its inverse is
+      # [[R^T, -R^T t], [0, 1]].
+      world_to_vehicle_rotation = tf.transpose(frame_pose[0:3, 0:3])
+      world_to_vehicle_translation = -tf.einsum(
+          'ij,j->i', world_to_vehicle_rotation, frame_pose[0:3, 3])
       # [H, W, 3]
-      lidar_image_points = tf.einsum(
-          'ij,hwj->hwi', world_to_vehicle_rotation,
-          lidar_image_points) + world_to_vehicle_translation[tf.newaxis,
-                                                             tf.newaxis, :]
+      directions = tf.einsum('ij,hwj->hwi', world_to_vehicle_rotation,
+                             directions)
+      origins = tf.einsum('ij,hwj->hwi', world_to_vehicle_rotation,
+                          origins) + world_to_vehicle_translation
+
+    return directions, origins
+
+  def _XYZFromRangeImage(self, lidar_image, lidar_image_mask, rays):
+    """Extract the cartesian coordinates from the range image.
+
+    Args:
+       lidar_image: [H, W, C] range image Tensor.
+       lidar_image_mask: [H, W] boolean indicating which 2d coordinates in the
+         lidar image are present.
+       rays: The (directions, origins) returned by _RangeImageRays() for the
+         laser of lidar_image.
 
-    return lidar_image_points
+    Returns:
+      [H, W, 3] range image cartesian coordinates.
+    """
+    directions, origins = rays
+    conversion_dtype = directions.dtype
+    # Only the range channel is used, so only it is masked. A select rather
+    # than a multiply by the mask, so that masked out NaN ranges become 0.
+    lidar_image_range = tf.cast(lidar_image[..., 0], conversion_dtype)
+    lidar_image_range = tf.where(lidar_image_mask, lidar_image_range,
+                                 tf.zeros_like(lidar_image_range))
+    lidar_image_points = (
+        lidar_image_range[..., tf.newaxis] * directions + origins)
+    return py_utils.HasShape(lidar_image_points, py_utils.GetShape(directions))
 
   def Shape(self):
     """Shape of BBoxes."""
     p = self.params
     shapes = {}
-    for laser in p.cbr_laser_names:
-      cbr_shape = p.cbr_ri_shape[:-1]
-      for returns in p.returns:
-        shape_dict = py_utils.NestedMap({
-            'xyz': tf.TensorShape(cbr_shape + [3]),
-            'features': tf.TensorShape(cbr_shape + [4]),
-            'mask': tf.TensorShape(cbr_shape),
-        })
-        shapes['%s_%s' % (laser, returns)] = shape_dict
-
-      shapes['%s_extrinsics' % laser] = tf.TensorShape([4, 4])
-      shapes['%s_beam_inclinations' % laser] = tf.TensorShape([2])
-    for laser in p.gbr_laser_names:
-      gbr_shape = p.gbr_ri_shape[:-1]
-      for returns in p.returns:
-        shape_dict = py_utils.NestedMap({
-            'xyz': tf.TensorShape(gbr_shape + [3]),
-            'features': tf.TensorShape(gbr_shape + [4]),
-            'mask': tf.TensorShape(gbr_shape),
-        })
-        shapes['%s_%s' % (laser, returns)] = shape_dict
-      shapes['%s_extrinsics' % laser] = tf.TensorShape([4, 4])
-      shapes['%s_beam_inclinations' % laser] = tf.TensorShape([64])
+    # CBRs have 2 beam inclinations (min and max), GBRs have one per row.
+    for laser_names, ri_shape, num_inclinations in [
+        (p.cbr_laser_names, p.cbr_ri_shape, 2),
+        (p.gbr_laser_names, p.gbr_ri_shape, p.gbr_ri_shape[0]),
+    ]:
+      hw_shape = ri_shape[:-1]
+      for laser in laser_names:
+        for returns in p.returns:
+          shapes['%s_%s' % (laser, returns)] = py_utils.NestedMap({
+              'xyz': tf.TensorShape(hw_shape + [3]),
+              'features': tf.TensorShape(hw_shape + [4]),
+              'mask': tf.TensorShape(hw_shape),
+          })
+        shapes['%s_extrinsics' % laser] = tf.TensorShape([4, 4])
+        shapes['%s_beam_inclinations' % laser] = tf.TensorShape(
+            [num_inclinations])
 
     return py_utils.NestedMap(shapes)
 
@@ -891,10 +965,13 @@ class FilterNLZPoints(input_preprocessors.Preprocessor):
     # The 3rd feature in the laser is 1.0 for points in a no-label-zone
     # and -1. for normal points.
     is_not_nlz = tf.not_equal(features.lasers.points_feature[:, 2], 1.0)
-    features.lasers.points_xyz = tf.boolean_mask(features.lasers.points_xyz,
-                                                 is_not_nlz)
-    features.lasers.points_feature = tf.boolean_mask(
-        features.lasers.points_feature, is_not_nlz)
+    # Compute the indices of the kept points once and share them between both
+    # gathers.
+    keep_indices = tf.reshape(tf.where(is_not_nlz), [-1])
+    features.lasers.points_xyz = tf.gather(features.lasers.points_xyz,
+                                           keep_indices)
+    features.lasers.points_feature = tf.gather(features.lasers.points_feature,
+                                               keep_indices)
     return features
 
   def TransformShapes(self, shapes):
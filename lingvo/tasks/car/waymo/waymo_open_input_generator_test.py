@@ -28,6 +28,78 @@ import numpy as np
 FLAGS = tf.flags.FLAGS
 
 
+def _FloatFeature(values):
+  return tf.train.Feature(float_list=tf.train.FloatList(value=values))
+
+
+def _Int64Feature(values):
+  return tf.train.Feature(int64_list=tf.train.Int64List(value=values))
+
+
+def _BytesFeature(values):
+  return tf.train.Feature(bytes_list=tf.train.BytesList(value=values))
+
+
+def _SerializedExample(feature):
+  example = tf.train.Example(features=tf.train.Features(feature=feature))
+  return example.SerializeToString()
+
+
+def _RigidTransform(yaw, pitch, roll, translation):
+  """Returns a [4, 4] rigid transform from Euler angles and a translation."""
+  cy, sy = np.cos(yaw), np.sin(yaw)
+  cp, sp = np.cos(pitch), np.sin(pitch)
+  cr, sr = np.cos(roll), np.sin(roll)
+  rot_z = np.array([[cy, -sy, 0.], [sy, cy, 0.], [0., 0., 1.]])
+  rot_y = np.array([[cp, 0., sp], [0., 1., 0.], [-sp, 0., cp]])
+  rot_x = np.array([[1., 0., 0.], [0., cr, -sr], [0., sr, cr]])
+  transform = np.eye(4)
+  transform[:3, :3] = rot_z.dot(rot_y).dot(rot_x)
+  transform[:3, 3] = translation
+  return transform
+
+
+def _BaselineXYZ(range_image,
+                 extrinsics,
+                 inclinations,
+                 pixel_pose=None,
+                 frame_pose=None):
+  """Computes range image xyz as RangeImageExtractor originally did.
+
+  Args:
+    range_image: [H, W, C] range image.
+    extrinsics: [4, 4] extrinsics.
+    inclinations: [H] beam inclinations in ascending order.
+    pixel_pose: Optional [H, W, 4, 4] per pixel pose.
+    frame_pose: [4, 4] frame pose, required with pixel_pose.
+
+  Returns:
+    [H, W, 3] xyz.
+  """
+  height, width, _ = range_image.shape
+  inclinations = inclinations[::-1]
+  az_correction = np.arctan2(extrinsics[1, 0], extrinsics[0, 0])
+  ratios = (np.arange(width, 0, -1) - .5) / width
+  azimuth = (ratios * 2. - 1.) * np.pi - az_correction
+  with np.errstate(invalid='ignore'):
+    mask = range_image[..., 0] >= 0
+  ranges = np.where(mask, range_image[..., 0], 0.)
+  cos_incl = np.cos(inclinations)[:, np.newaxis]
+  sin_incl = np.sin(inclinations)[:, np.newaxis]
+  x = np.cos(azimuth)[np.newaxis, :] * cos_incl * ranges
+  y = np.sin(azimuth)[np.newaxis, :] * cos_incl * ranges
+  z = np.broadcast_to(sin_incl, [height, width]) * ranges
+  points = np.stack([x, y, z], -1)
+  points = points.dot(extrinsics[:3, :3].T) + extrinsics[:3, 3]
+  if pixel_pose is not None:
+    points = np.einsum('hwij,hwj->hwi', pixel_pose[..., :3, :3],
+                       points) + pixel_pose[..., :3, 3]
+    world_to_vehicle = np.linalg.inv(frame_pose)
+    points = points.dot(
+        world_to_vehicle[:3, :3].T) + world_to_vehicle[:3, 3]
+  return points
+
+
 class WaymoOpenInputGeneratorTest(test_utils.TestCase):
 
   def testFilterNLZ(self):
@@ -52,6 +124,172 @@ class WaymoOpenInputGeneratorTest(test_utils.TestCase):
       self.assertEqual((num_points - 1, 3),
                        actual_features.lasers.points_xyz.shape)
 
+  def _ExtractLabels(self, feature, **kwargs):
+    p = waymo_open_input_generator.WaymoLabelExtractor.Params().Set(**kwargs)
+    with self.session(graph=tf.Graph()) as sess:
+      extractor = p.Instantiate()
+      features = tf.parse_single_example(
+          _SerializedExample(feature), extractor.FeatureMap())
+      return sess.run(extractor.Extract(features))
+
+  def testLabelExtractor(self):
+    bboxes_3d = np.arange(3 * 7, dtype=np.float32).reshape([3, 7])
+    label_metadata = -np.arange(3 * 4, dtype=np.float32).reshape([3, 4])
+    feature = {
+        'labels': _Int64Feature([1, 2, 3]),
+        'label_ids': _BytesFeature([b'a', b'b', b'c']),
+        'detection_difficulties': _Int64Feature([0, 1, 2]),
+        'tracking_difficulties': _Int64Feature([2, 1, 0]),
+        'bboxes_3d': _FloatFeature(bboxes_3d.ravel()),
+        'bboxes_3d_num_points': _Int64Feature([10, 20, 30]),
+        'label_metadata': _FloatFeature(label_metadata.ravel()),
+    }
+    actual = self._ExtractLabels(
+        feature, max_num_objects=4, filter_labels=[1, 2])
+
+    self.assertAllEqual([1, 2, 3, 0], actual.labels)
+    self.assertAllEqual([b'a', b'b', b'c', b''], actual.label_ids)
+    self.assertAllEqual([0, 1, 2, 0], actual.detection_difficulties)
+    self.assertAllEqual([2, 1, 0, 0], actual.tracking_difficulties)
+    self.assertAllClose(
+        np.concatenate([bboxes_3d, np.zeros([1, 7])]), actual.bboxes_3d)
+    self.assertAllEqual([10, 20, 30, 0], actual.bboxes_3d_num_points)
+    self.assertAllClose([1., 1., 0., 0.], actual.bboxes_3d_mask)
+    self.assertAllClose([1., 1., 1., 0.], actual.unfiltered_bboxes_3d_mask)
+    padded_metadata = np.concatenate([label_metadata, np.zeros([1, 4])])
+    self.assertAllClose(padded_metadata[:, :2], actual.speed)
+    self.assertAllClose(padded_metadata[:, 2:], actual.acceleration)
+
+  def testLabelExtractorPadsFieldsIndependently(self):
+    # label_metadata and the difficulties are missing, and there are more
+    # objects than max_num_objects.
+    bboxes_3d = np.arange(3 * 7, dtype=np.float32).reshape([3, 7])
+    feature = {
+        'labels': _Int64Feature([1, 2, 3]),
+        'label_ids': _BytesFeature([b'a', b'b', b'c']),
+        'bboxes_3d': _FloatFeature(bboxes_3d.ravel()),
+        'bboxes_3d_num_points': _Int64Feature([10, 20, 30]),
+    }
+    actual = self._ExtractLabels(feature, max_num_objects=2)
+
+    self.assertAllEqual([1, 2], actual.labels)
+    self.assertAllEqual([b'a', b'b'], actual.label_ids)
+    self.assertAllEqual([0, 0], actual.detection_difficulties)
+    self.assertAllEqual([0, 0], actual.tracking_difficulties)
+    self.assertAllClose(bboxes_3d[:2], actual.bboxes_3d)
+    self.assertAllEqual([10, 20], actual.bboxes_3d_num_points)
+    self.assertAllClose([1., 1.], actual.bboxes_3d_mask)
+    self.assertAllClose([1., 1.], actual.unfiltered_bboxes_3d_mask)
+    self.assertAllClose(np.zeros([2, 2]), actual.speed)
+    self.assertAllClose(np.zeros([2, 2]), actual.acceleration)
+
+  def _RangeImageInputs(self, random_poses=True):
+    """Returns (params, feature, expected) for a small CBR and GBR laser."""
+    rng = np.random.RandomState(12345)
+    p = waymo_open_input_generator.RangeImageExtractor.Params().Set(
+        cbr_laser_names=['FRONT'],
+        cbr_ri_shape=[3, 5, 4],
+        gbr_laser_names=['TOP'],
+        gbr_ri_shape=[64, 4, 4])
+
+    def _Pose():
+      if not random_poses:
+        return np.eye(4)
+      return _RigidTransform(
+          rng.uniform(-np.pi, np.pi), rng.uniform(-.1, .1),
+          rng.uniform(-.1, .1), rng.uniform(-5., 5., size=[3]))
+
+    def _RangeImage(ri_shape):
+      range_image = rng.uniform(0., 20., size=ri_shape)
+      # Points that are not present, including a NaN range.
+      range_image[0, 0, 0] = -1.
+      range_image[-1, -1, 0] = np.nan
+      return range_image
+
+    frame_pose = _Pose()
+    feature = {'pose': _FloatFeature(frame_pose.ravel())}
+    expected = {}
+
+    # CBR: uniform inclinations given by their min and max.
+    cbr_extrinsics = _Pose()
+    cbr_min, cbr_max = -.3, .2
+    height = p.cbr_ri_shape[0]
+    cbr_inclinations = (.5 + np.arange(height)) / height * (cbr_max -
+                                                            cbr_min) + cbr_min
+    feature.update({
+        'FRONT_extrinsics': _FloatFeature(cbr_extrinsics.ravel()),
+        'FRONT_beam_inclination_min': _FloatFeature([cbr_min]),
+        'FRONT_beam_inclination_max': _FloatFeature([cbr_max]),
+    })
+    for returns in p.returns:
+      range_image = _RangeImage(p.cbr_ri_shape)
+      feature['FRONT_%s' % returns] = _FloatFeature(range_image.ravel())
+      feature['FRONT_%s_shape' % returns] = _Int64Feature(p.cbr_ri_shape)
+      expected['FRONT_%s' % returns] = (range_image,
+                                        _BaselineXYZ(range_image,
+                                                     cbr_extrinsics,
+                                                     cbr_inclinations))
+
+    # GBR: 64 non-uniform ascending inclinations and a per pixel pose.
+    gbr_extrinsics = _Pose()
+    gbr_inclinations = np.sort(rng.uniform(-.4, .1, size=[64]))
+    pixel_pose = np.stack([_Pose() for _ in range(64 * p.gbr_ri_shape[1])])
+    pixel_pose = pixel_pose.reshape(p.gbr_ri_shape[:2] + [4, 4])
+    feature.update({
+        'TOP_extrinsics': _FloatFeature(gbr_extrinsics.ravel()),
+        'TOP_beam_inclinations': _FloatFeature(gbr_inclinations),
+        'TOP_pose': _FloatFeature(pixel_pose.ravel()),
+    })
+    for returns in p.returns:
+      range_image = _RangeImage(p.gbr_ri_shape)
+      feature['TOP_%s' % returns] = _FloatFeature(range_image.ravel())
+      feature['TOP_%s_shape' % returns] = _Int64Feature(p.gbr_ri_shape)
+      expected['TOP_%s' % returns] = (range_image,
+                                      _BaselineXYZ(range_image, gbr_extrinsics,
+                                                   gbr_inclinations, pixel_pose,
+                                                   frame_pose))
+    return p, feature, expected
+
+  def _ExtractRangeImages(self, p, feature):
+    with self.session(graph=tf.Graph()) as sess:
+      extractor = p.Instantiate()
+      features = tf.parse_single_example(
+          _SerializedExample(feature), extractor.FeatureMap())
+      return sess.run(extractor.Extract(features))
+
+  def testRangeImageExtractor(self):
+    p, feature, expected = self._RangeImageInputs()
+    actual = self._ExtractRangeImages(p, feature)
+    for key, (range_image, xyz) in expected.items():
+      self.assertAllClose(range_image, actual[key].features)
+      self.assertAllClose((range_image[..., 0] >= 0).astype(np.float32),
+                          actual[key].mask)
+      self.assertFalse(np.any(np.isnan(actual[key].xyz)))
+      self.assertAllClose(xyz, actual[key].xyz, rtol=1e-4, atol=1e-3)
+
+  def testRangeImageExtractorJitXyz(self):
+    p, feature, _ = self._RangeImageInputs()
+    actual = self._ExtractRangeImages(p, feature)
+    actual_jit = self._ExtractRangeImages(p.Copy().Set(jit_xyz=True), feature)
+    for key in ['FRONT_ri1', 'FRONT_ri2', 'TOP_ri1', 'TOP_ri2']:
+      self.assertAllClose(actual[key].xyz, actual_jit[key].xyz)
+
+  def testRangeImageRowOrder(self):
+    # With identity poses, z / range of each pixel is the sine of its row's
+    # inclination: the first row has the highest inclination.
+    p, feature, _ = self._RangeImageInputs(random_poses=False)
+    actual = self._ExtractRangeImages(p, feature)
+    for laser, inclinations in [
+        ('FRONT', np.linspace(.2, -.3, 2 * p.cbr_ri_shape[0] + 1)[1::2]),
+        ('TOP', np.sort(feature['TOP_beam_inclinations'].float_list.value)
+         [::-1]),
+    ]:
+      xyz = actual['%s_ri1' % laser].xyz
+      ranges = np.linalg.norm(xyz, axis=-1)
+      # Column 1 is present in every row.
+      self.assertAllClose(
+          np.sin(inclinations), xyz[:, 1, 2] / ranges[:, 1], atol=1e-5)
+
 
 if __name__ == '__main__':
   tf.test.main()